@@ -0,0 +1,190 @@
+"""Micro-benchmark for the Hl7Record attributes and accessors used by the renderers.
+
+It lives outside the lambda modules and is never imported by the handler.
+Run from the repository root:
+
+    python benchmarks/benchmark_hl7_record.py [iterations]
+"""
+import sys
+from os import environ
+from pathlib import Path
+from timeit import timeit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+for variable in (
+    "DESTINATION_BUCKET",
+    "OAUTH_BASE_URL",
+    "BASE_URL",
+    "SECRET_MANAGER_HL7_ARN",
+):
+    environ.setdefault(variable, "benchmark")
+
+from flatten_dict import flatten
+
+from config import HL7_OPTIONAL_ARGS, HL7_REQUIRED_ARGS, HL7_REQUIRED_ARGS_IN_LISTS
+from hl7_objects import HL7_PAYLOAD_VALIDATOR, Hl7Record, MasterFileJson
+
+
+MASTER_FILE = {
+    "doh_mappings": [{"doh": "Utah", "orgList": ["org-1"]}],
+    "result_table": {},
+}
+
+RECORD = {
+    "order": {
+        "id": "order-1",
+        "patient_id": "P123456789",
+        "test_kit_id": "kit-1",
+        "sample_date": "2022-08-18T15:04:05.000Z",
+        "procedure_type_id": "PCR",
+        "states": {"RESULTED": "2022-08-19T10:00:00.000Z"},
+        "results": [{"result_name": "c19", "result": "negative"}],
+    },
+    "facility": {
+        "org_id": "org-1",
+        "name": "Facility",
+        "clia_id": "00D0000000",
+        "address": {
+            "address": "1 Main St",
+            "city": "Salt Lake City",
+            "state": "UT",
+            "postal_code": "84101",
+        },
+    },
+    "test_kit_types": {"assay": "Assay", "procedure_type_ids": ["PCR"]},
+    "patient": {
+        "personal": {
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "gender": "F",
+            "dob": "1990-01-01",
+            "race": "white",
+            "ethnicity": "not hispanic",
+        },
+        "address": {
+            "street_1": "2 Main St",
+            "street_2": "Apt 3",
+            "city": "Salt Lake City",
+            "state": "Utah",
+            "postal_code": "84101",
+            "county": "Salt Lake",
+        },
+        "contact": {"phone": "8015550100"},
+    },
+}
+
+# accessor calls made by the PID and ORC blocks of one message
+MESSAGE_PATIENT_FIELDS = [
+    ("personal", "last_name"),
+    ("personal", "first_name"),
+    ("personal", "gender"),
+    ("address", "city"),
+    ("address", "state"),
+    ("address", "state"),
+    ("address", "postal_code"),
+    ("address", "state"),
+]
+MESSAGE_FACILITY_FIELDS = [
+    ("address", "address"),
+    ("address", "city"),
+    ("address", "state"),
+    ("address", "postal_code"),
+]
+
+
+class LegacyRecord:
+    """Dict backed record with the attribute lookup SharedMethods used before __slots__."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update({f"_{k}": v for k, v in kwargs.items()})
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__[f"_{name}"]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def read_attributes(record):
+    for _ in range(10):
+        record.order
+        record.patient
+        record.facility
+        record.test_kit_types
+
+
+def legacy_parse_flat_dict(collection, *args):
+    try:
+        return flatten(collection)[args]
+    except KeyError:
+        return "^"
+
+
+def legacy_validate(record: dict):
+    flat_dict = flatten(record)
+    missing_optional = [key for key in HL7_OPTIONAL_ARGS if key not in flat_dict]
+    missing_required = [key for key in HL7_REQUIRED_ARGS if key not in flat_dict]
+
+    for paths in HL7_REQUIRED_ARGS_IN_LISTS:
+        for key, value_to_check in paths.items():
+            if not all(value_to_check in item for item in flat_dict[key]):
+                missing_required.append(key + (value_to_check,))
+
+    return missing_optional, missing_required
+
+
+def render_accessors(record: Hl7Record):
+    for fields in MESSAGE_PATIENT_FIELDS:
+        record.get_patient_data(*fields)
+    for fields in MESSAGE_FACILITY_FIELDS:
+        record.get_facility_data(*fields)
+
+
+def legacy_render_accessors(record: Hl7Record):
+    for fields in MESSAGE_PATIENT_FIELDS:
+        legacy_parse_flat_dict(record.patient, *fields)
+    for fields in MESSAGE_FACILITY_FIELDS:
+        legacy_parse_flat_dict(record.facility, *fields)
+
+
+def report(name: str, seconds: float, iterations: int, baseline: float = None):
+    line = f"{name:<40} {seconds / iterations * 1e6:10.2f} us"
+    if baseline:
+        line += f"  ({baseline / seconds:.1f}x)"
+    print(line)
+
+
+def main(iterations: int):
+    master_file = MasterFileJson(json_data=MASTER_FILE)
+
+    def new_record():
+        return Hl7Record(record=RECORD, logger=None, MasterFileJson=master_file)
+
+    print(f"{iterations} iterations, per call:")
+
+    legacy = timeit(lambda: legacy_render_accessors(new_record()), number=iterations)
+    current = timeit(lambda: render_accessors(new_record()), number=iterations)
+    build = timeit(new_record, number=iterations)
+
+    report("record build", build, iterations)
+    report("message accessors, flatten per call", legacy - build, iterations)
+    report("message accessors, cached views", current - build, iterations, legacy - build)
+
+    legacy_validation = timeit(lambda: legacy_validate(RECORD), number=iterations)
+    validation = timeit(lambda: HL7_PAYLOAD_VALIDATOR.validate(RECORD), number=iterations)
+
+    report("payload validation, flatten", legacy_validation, iterations)
+    report("payload validation, paths", validation, iterations, legacy_validation)
+
+    record = new_record()
+    legacy_record = LegacyRecord(**RECORD)
+    legacy_reads = timeit(lambda: read_attributes(legacy_record), number=iterations)
+    reads = timeit(lambda: read_attributes(record), number=iterations)
+
+    report("attribute read, dict backed", legacy_reads / 40, iterations)
+    report("attribute read, __slots__", reads / 40, iterations, legacy_reads / 40)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -10,12 +10,32 @@ SECRET_MANAGER_HL7_ARN = environ["SECRET_MANAGER_HL7_ARN"]
 DEBUG_MODE = True
 PROCESS_REPEATED_MESSAGES = False
 
-API_RETRY = 5
+# NomiApiCall attempts, also used for its OAuth token request. Kept at 1 so a failing
+# call is not retried by both NomiApiCall and the ApiRequest retry policy, multiplying
+# the attempts; a failed token request fails the record, which Kafka redelivers.
+API_RETRY = 1
 API_TOKEN_TIME_LIMIT = 3600
 APIS_TIMEOUT_TIME = 10
 
 API_CALL_MAX_ATTEMPTS = 5
-API_CALL_SLEEP = 10
+API_CALL_BASE_SLEEP = 0.5  # first backoff, doubled on every retry
+API_CALL_SLEEP = 10  # maximum backoff between attempts
+API_CALL_UNKNOWN_ERROR_MAX_ATTEMPTS = 3  # attempts for errors without status or known type
+API_CALL_RETRY_BUDGET = 50  # retries allowed per lambda invocation
+API_CALL_DEADLINE_RESERVE = 30  # seconds kept free before the lambda timeout
+DOCDB_FETCH_MAX_WORKERS = 16  # concurrent DocDB lookups shared by all records
+
+KAFKA_BATCH_MAX_WORKERS = 8  # concurrent Kafka records per lambda invocation
+RECORD_TIME_RESERVE_MS = 60000  # minimum lambda time left to start a new record
+PREFETCH_TIME_LIMIT_MS = 30000  # maximum lambda time spent requesting the batch data
+
+# ----------------- DocDB reference cache (lives in the warm container) -----------------
+DOCDB_CACHE_MAX_ENTRIES = 2048
+DOCDB_CACHE_TTLS = {  # seconds, collections not listed here are never cached
+    "procedure": 3600,
+    "test_kit_type": 3600,
+    "facility": 900,
+}
 
 STATES_LOCAL_TIME_ZONE_ADJUSTMENT_FROM_UTC = {"hawaii": -10}
 STATES_WITHOUT_UTC_ADJUSTMENT = [
@@ -1,42 +1,128 @@
+from copy import copy, deepcopy
+from time import monotonic
+from threading import Lock
 from typing import Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from logging import INFO, DEBUG
 from aws_lambda_powertools import Logger
 from dsl_utils.nomi_apis.tiger import TigerApi
-from dsl_utils.decorators import function_retry_decorator
 from dsl_utils.nomi_apis.api_call import NomiApiCall
+from ttl_lru_cache import TtlLruCache
+from retry_policy import RetryBudget, error_status_code, retry_policy_decorator
+from record_context import (
+    add_record_context_filter,
+    append_record_keys,
+    bind_record_context,
+    record_context,
+)
+from hl7_objects import ORDER_SKIP_REASONS, order_skip_reason
 
 from config import (
     DEBUG_MODE,
     API_CALL_MAX_ATTEMPTS,
+    API_CALL_BASE_SLEEP,
     API_CALL_SLEEP,
+    API_CALL_UNKNOWN_ERROR_MAX_ATTEMPTS,
+    API_CALL_RETRY_BUDGET,
+    API_CALL_DEADLINE_RESERVE,
+    DOCDB_FETCH_MAX_WORKERS,
+    DOCDB_CACHE_MAX_ENTRIES,
+    DOCDB_CACHE_TTLS,
 )
 
 LOGGER = Logger(service="doc_db_mapper", level=DEBUG if DEBUG_MODE else INFO)
 LOGGER.append_keys(order_id="")
+add_record_context_filter(LOGGER)
+
+# shared by every record of every warm invocation
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=DOCDB_FETCH_MAX_WORKERS)
+REFERENCE_CACHE = TtlLruCache(max_entries=DOCDB_CACHE_MAX_ENTRIES)
+RETRY_BUDGET = RetryBudget(
+    max_retries=API_CALL_RETRY_BUDGET, deadline_reserve=API_CALL_DEADLINE_RESERVE
+)
+# guards the batch memos, written by the records and fetch threads of a batch
+_MEMO_LOCK = Lock()
+
+# orders skipped before their references were requested, by reason, in this container
+ORDER_SKIPS = {reason: 0 for reason in ORDER_SKIP_REASONS}
+_ORDER_SKIPS_LOCK = Lock()
+
+# collections requested for every order, mapped to the order key holding their id
+ORDER_REFERENCES = {
+    "procedure": "procedure_type_id",
+    "test_kit_type": "test_kit_type_id",
+    "facility": "test_location_id",
+    "patient": "patient_id",
+}
+
+
+class CollectionRequestError(Exception):
+    """Error raised when one of the concurrent collection requests fails."""
+
+    def __init__(self, collection: str, error: Exception):
+        super().__init__(str(error))
+        self.collection = collection
+        self.error = error
+        self.status_code = error_status_code(error)
+
+
+class ApiRequestError(Exception):
+    """Error raised when the data of an encounter cannot be retrieved. It carries the
+    HTTP status of the failed request, None when there was no response."""
+
+    def __init__(self, collection: str, error: Exception):
+        super().__init__(
+            f"Failed to retrieve API information at collection: {collection}, error: {str(error)}"
+        )
+        self.collection = collection
+        self.status_code = error_status_code(error)
+
 
+def deadline_result(future: Future, deadline: float = None):
+    """Function to wait for a future until a monotonic deadline.
 
-def join_address(input_dict: dict) -> str:
+    Args:
+        future (Future)
+        deadline (float, optional). Defaults to None, no deadline.
+
+    Raises:
+        FuturesTimeoutError: if the deadline is reached first.
+
+    Returns:
+        Any: the future result.
+    """
+    timeout = None if deadline is None else max(0, deadline - monotonic())
+
+    return future.result(timeout=timeout)
+
+
+def count_order_skip(reason: str) -> None:
+    with _ORDER_SKIPS_LOCK:
+        ORDER_SKIPS[reason] += 1
+
+
+def join_address(input_dict: dict) -> dict:
     """Function to join address_1 and address_2 if both keys are present.
-    Both keys are deleted and a new address key is created.
+    A copy of the address with a new address key is returned, input_dict is not modified.
 
-    If only address_1 is present, then address_1 is deleted and address key is returned.
+    If only address_1 is present, then the address key is address_1.
 
     Args:
         input_dict (dict)
 
     Returns:
-        str
+        dict
     """
     logic_test = ["street_1" in input_dict, "street_2" in input_dict]
+    output_dict = dict(input_dict)
 
     if all(logic_test):
-        input_dict["address"] = input_dict["street_1"] + " " + input_dict["street_2"]
-
-        return
-    if any(logic_test):
-        input_dict["address"] = input_dict["street_1"]
+        output_dict["address"] = input_dict["street_1"] + " " + input_dict["street_2"]
+    elif any(logic_test):
+        output_dict["address"] = input_dict["street_1"]
 
-        return
+    return output_dict
 
 
 class ApiRequest(TigerApi):
@@ -45,15 +131,27 @@ class ApiRequest(TigerApi):
         NomiApiCall: NomiApiCall,
         order_id = None,
         encounter_id = None,
+        memo: dict = None,
     ):
         super().__init__(NomiApiCall)
 
         self.order_id = order_id
         self.encounter_id = encounter_id
+        # futures of the documents requested, shared across ApiRequests when a batch memo is given
+        self.memo = memo if memo is not None else {}
 
-    @function_retry_decorator(API_CALL_MAX_ATTEMPTS, LOGGER, API_CALL_SLEEP, False)
+    @retry_policy_decorator(
+        API_CALL_MAX_ATTEMPTS,
+        LOGGER,
+        API_CALL_BASE_SLEEP,
+        API_CALL_SLEEP,
+        RETRY_BUDGET,
+        unknown_error_attempts=API_CALL_UNKNOWN_ERROR_MAX_ATTEMPTS,
+    )
     def get_data_from_database(self, *args, **kargs) -> Union[dict, list]:
         """Method to send API request to the desired DocDB Collection.
+        Retryable errors are retried, unrecognised errors a bounded number of times,
+        see retry_policy.allowed_attempts.
 
         Raises:
             ValueError: if reject_multiple_responses argument is passed and response list len is higher than 1.
@@ -63,20 +161,120 @@ class ApiRequest(TigerApi):
         """
         return super().get_data_from_database(*args, **kargs)
 
+    def get_document(self, collection: str, *url_args) -> Union[dict, list]:
+        """Method to request a DocDB document at most once per memo. Documents are keyed
+        by collection and the identifiers used to build the URL, concurrent requests for
+        the same key wait for the first one. A failed request is not memoised. Slow
+        changing collections listed in DOCDB_CACHE_TTLS are also served from the
+        container REFERENCE_CACHE.
+
+        The memo and the cache are shared, so every caller gets its own copy.
+
+        Args:
+            collection (str)
+
+        Returns:
+            Union[dict,list]
+        """
+        key = (collection, *url_args)
+
+        with _MEMO_LOCK:
+            future = self.memo.get(key)
+            requested = future is None
+
+            if requested:
+                future = self.memo[key] = Future()
+
+        if requested:
+            try:
+                future.set_result(self.request_document(collection, *url_args))
+            except Exception as e:
+                with _MEMO_LOCK:
+                    del self.memo[key]
+                future.set_exception(e)
+
+        return deepcopy(future.result())
+
+    def request_document(self, collection: str, *url_args) -> Union[dict, list]:
+        """Method to request a DocDB document, from the REFERENCE_CACHE when the
+        collection is listed in DOCDB_CACHE_TTLS.
+
+        Args:
+            collection (str)
+
+        Returns:
+            Union[dict,list]
+        """
+        key = (collection, *url_args)
+        ttl = DOCDB_CACHE_TTLS.get(collection)
+        data = REFERENCE_CACHE.get(key) if ttl else None
+
+        if data is None:
+            data = self.get_data_from_database(self.create_url(collection, *url_args))
+
+            if ttl:
+                REFERENCE_CACHE.set(key, data, ttl=ttl)
+
+        return data
+
+    def get_documents(self, requests: dict) -> dict:
+        """Method to request independent DocDB documents concurrently.
+
+        Args:
+            requests (dict): collection name mapped to the url arguments.
+
+        Raises:
+            CollectionRequestError: if any request fails, tagged with its collection.
+
+        Returns:
+            dict: collection name mapped to the document.
+        """
+        futures = {
+            collection: FETCH_EXECUTOR.submit(
+                bind_record_context(self.get_document), collection, *url_args
+            )
+            for collection, url_args in requests.items()
+        }
+
+        documents = {}
+        for collection, future in futures.items():
+            try:
+                documents[collection] = future.result()
+            except Exception as e:
+                raise CollectionRequestError(collection=collection, error=e) from e
+
+        return documents
+
+    def for_encounter(self, encounter_id: str) -> "ApiRequest":
+        """Method to return a copy of the request bound to encounter_id that shares the memo.
+
+        Args:
+            encounter_id (str)
+
+        Returns:
+            ApiRequest
+        """
+        api_request = copy(self)
+        api_request.encounter_id = encounter_id
+
+        return api_request
+
     def get_order_data(self, _id) -> list:
         """Method to request all the data related to an encounter.
 
+        Orders that do not require an HL7 message (see order_skip_reason) get no
+        references requested, their payload is {"order": order, "skip_reason": reason}.
+        Skips are counted by the caller that processes the payload.
+
         Returns:
             list
         """
         try:
             collection = "order"
-            order_data = self.get_data_from_database(
-                self.create_url("order_search", _id, self.order_id)
-            )
+            order_data = self.get_document("order_search", _id, self.order_id)
             order_payload = []
             for order in order_data:
-                LOGGER.append_keys(order_id=order["id"])
+                append_record_keys(order_id=order["id"])
                 if (
                     "RESULTED" not in order["states"]
                 ):  # this means sample_value is not complete
@@ -84,36 +282,41 @@ class ApiRequest(TigerApi):
                         "Order does not have a RESULTED state (Order is not completed)."
                     )
 
-                collection = "procedure"
-                procedure_data = self.get_data_from_database(
-                    self.create_url("procedure", "", order["procedure_type_id"])
-                )
+                skip_reason = order_skip_reason(order)
+                if skip_reason is not None:
+                    order_payload.append({"order": order, "skip_reason": skip_reason})
+                    continue
 
-                collection = "test_kit_type"
-                test_kit_types_data = self.get_data_from_database(
-                    self.create_url("test_kit_type", "", order["test_kit_type_id"])
-                )
+                collection = "procedure, test_kit_type, facility, patient"
+                try:
+                    documents = self.get_documents(
+                        {
+                            collection: ("", order[order_key])
+                            for collection, order_key in ORDER_REFERENCES.items()
+                        }
+                    )
+                except CollectionRequestError as e:
+                    collection = e.collection
+                    raise
 
-                collection = "facility"
-                facility_data = self.get_data_from_database(
-                    self.create_url("facility", "", order["test_location_id"])
-                )
+                procedure_data = documents["procedure"]
+                test_kit_types_data = documents["test_kit_type"]
+                facility_data = documents["facility"]
 
                 if "address" in facility_data:
-                    join_address(input_dict=facility_data["address"])
+                    facility_data["address"] = join_address(
+                        input_dict=facility_data["address"]
+                    )
 
                 collection = "encounter"
-                encounter_data = self.get_data_from_database(
-                    self.create_url("encounter", _id, self.encounter_id)
+                encounter_data = self.get_document(
+                    "encounter", _id, self.encounter_id
                 )
 
                 assert len(encounter_data) == 1, "Multiple encounters found"
                 encounter_data = encounter_data[0]
 
-                collection = "patient"
-                patient_data = self.get_data_from_database(
-                    self.create_url("patient", "", order["patient_id"])
-                )
+                patient_data = documents["patient"]
 
                 payload = {
                     "order": order,
@@ -126,11 +329,108 @@ class ApiRequest(TigerApi):
                 order_payload.append(payload)
 
         except Exception as e:
-            raise Exception(
-                f"Failed to retrieve API information at collection: {collection}, error: {str(e)}"
-            )
+            raise ApiRequestError(collection=collection, error=e) from e
         return order_payload
 
+    def get_batch_order_data(self, encounter_ids: list, timeout: float = None) -> dict:
+        """Method to request the data of every encounter in a Kafka batch. Orders are
+        searched once per encounter, then each distinct procedure, test kit type,
+        facility, patient and encounter referenced by the batch is requested once,
+        concurrently. The DocDB API has no multi id search, so distinct point lookups
+        are the fewest requests available.
+
+        Orders that do not require an HL7 message (see order_skip_reason) add no
+        references. Encounters with a failed request are left out of the result, so they
+        are requested again, and fail, when their own record is processed.
+
+        When the timeout is reached the requests not started yet are cancelled and an
+        empty result is returned. Documents already requested stay in the memo.
+
+        Args:
+            encounter_ids (list)
+            timeout (float, optional). Seconds the requests may take. Defaults to None.
+
+        Returns:
+            dict: encounter id mapped to the same order_payload list as get_order_data.
+        """
+        deadline = monotonic() + timeout if timeout is not None else None
+        encounter_ids = list(dict.fromkeys(encounter_ids))
+
+        order_searches = {
+            _id: FETCH_EXECUTOR.submit(
+                bind_record_context(self.get_document), "order_search", _id, self.order_id
+            )
+            for _id in encounter_ids
+        }
+        documents = {}
+
+        try:
+            references = {}
+            for _id, future in order_searches.items():
+                try:
+                    orders = deadline_result(future, deadline)
+                except FuturesTimeoutError:
+                    raise
+                except Exception as e:
+                    LOGGER.warning(f"Failed to search orders for encounter {_id}. Error: {e}")
+                    continue
+
+                references[_id] = set()
+                for order in orders:
+                    if order_skip_reason(order) is not None:
+                        continue
+
+                    references[_id].add(("encounter", _id, _id))
+                    references[_id].update(
+                        (collection, "", order[order_key])
+                        for collection, order_key in ORDER_REFERENCES.items()
+                        if order_key in order
+                    )
+
+            documents = {
+                reference: FETCH_EXECUTOR.submit(
+                    bind_record_context(self.get_document), *reference
+                )
+                for reference in set().union(*references.values())
+            }
+
+            failed_references = set()
+            for reference, future in documents.items():
+                try:
+                    deadline_result(future, deadline)
+                except FuturesTimeoutError:
+                    raise
+                except Exception as e:
+                    failed_references.add(reference)
+                    LOGGER.warning(f"Failed to request {reference[0]} {reference[-1]}. Error: {e}")
+
+        except FuturesTimeoutError:
+            for future in [*order_searches.values(), *documents.values()]:
+                future.cancel()
+
+            LOGGER.warning(
+                f"Batch requests took more than {timeout} s, records request their own data."
+            )
+
+            return {}
+
+        batch_payload = {}
+        for _id, encounter_references in references.items():
+            if encounter_references & failed_references:
+                continue
+
+            with record_context(_id=_id):
+                try:
+                    batch_payload[_id] = self.for_encounter(_id).get_order_data(_id)
+                except Exception as e:
+                    LOGGER.warning(f"Failed to build encounter {_id} payload. Error: {e}")
+
+        LOGGER.info(
+            f"Requested {len(encounter_ids)} encounters with {len(order_searches) + len(documents)} DocDB lookups."
+        )
+
+        return batch_payload
+
     def get_encounter_data(self, _id) -> list:
         """Method to request all the data related to an encounter.
         This will only be used for vaccines. Orders have different encounter
@@ -140,12 +440,8 @@ class ApiRequest(TigerApi):
         """
         try:
             collection = "encounter"
-            encounter_data = self.get_data_from_database(
-                self.create_url("encounter", _id, self.encounter_id)
-            )
+            encounter_data = self.get_document("encounter", _id, self.encounter_id)
         except Exception as e:
-            raise Exception(
-                f"Failed to retrieve API information at collection: {collection}, error: {str(e)}"
-            )
+            raise ApiRequestError(collection=collection, error=e) from e
 
         return encounter_data
\ No newline at end of file
@@ -1,11 +1,21 @@
-from time import perf_counter
+from typing import Callable, Tuple, Union
+import threading
+from time import perf_counter, monotonic
 from base64 import b64decode
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from aws_lambda_powertools import Logger
 from dsl_utils.nomi_apis.api_call import NomiApiCall
 from dsl_utils.aws_wrappers.secrets_manager import AwsSecretManager
 from dsl_utils.aws_wrappers.s3 import S3Bucket
 import dsl_test_encounters as test
 import dsl_vaccine_encounters as vax
+from doc_db_mapper import ApiRequest, REFERENCE_CACHE, RETRY_BUDGET, ORDER_SKIPS
+from record_context import (
+    add_record_context_filter,
+    append_record_keys,
+    record_context,
+)
 
 from config import (
     DESTINATION_BUCKET,
@@ -15,10 +25,19 @@ from config import (
     API_RETRY,
     DEBUG_MODE,
     APIS_TIMEOUT_TIME,
+    API_TOKEN_TIME_LIMIT,
+    KAFKA_BATCH_MAX_WORKERS,
+    RECORD_TIME_RESERVE_MS,
+    PREFETCH_TIME_LIMIT_MS,
 )
 
 LOGGER = Logger(service="dsl_hl7_kafka_order", level="DEBUG" if DEBUG_MODE else "INFO")
 
+_WARM_CLIENTS = {}  # survives across warm invocations of the container
+_WARM_CLIENTS_LOCK = threading.Lock()
+_WARM_CLIENTS_REFRESH_LOCK = threading.Lock()  # one refresh at a time
+AUTH_ERROR_STATUS_CODES = (401, 403)
+
 
 def set_logger_keys():
     LOGGER.append_keys(mrn="")
@@ -30,12 +49,490 @@ def set_logger_keys():
 
 
 set_logger_keys()
+add_record_context_filter(LOGGER)
+
+
+def create_clients() -> dict:
+    """Function to create the Secret Manager, DocDB API and S3 bucket objects.
+
+    Returns:
+        dict
+    """
+    LOGGER.info("Instantiating S3 bucket, DocDB and Secret Manager objects.")
+    secrets_manager = AwsSecretManager(SECRET_MANAGER_HL7_ARN)
+    token_tiger = secrets_manager.get_secret_token(secret_key="tiger_api_key")
+
+    api_call = NomiApiCall(
+        endpoint_url=DOC_DB_BASE_URL,
+        oauth_token=f"Basic {token_tiger}",
+        oauth_base_url=DOCDB_OAUTH_BASE_URL,
+        max_attempts=API_RETRY,
+        timeout_time=APIS_TIMEOUT_TIME,
+    )
+
+    return {
+        "api_call": api_call,
+        "bucket_obj": S3Bucket(DESTINATION_BUCKET),
+        "created_at": monotonic(),
+    }
+
+
+def get_warm_clients(stale_api_call: NomiApiCall = None) -> tuple:
+    """Function to return the API client and S3 bucket cached in the container.
+    Clients are rebuilt when they are older than API_TOKEN_TIME_LIMIT, or when
+    stale_api_call is still the cached client (auth failure refresh).
+
+    Args:
+        stale_api_call (NomiApiCall, optional). Client that failed to authenticate. Defaults to None.
+
+    Returns:
+        tuple: (NomiApiCall, S3Bucket)
+    """
+    with _WARM_CLIENTS_LOCK:
+        clients = dict(_WARM_CLIENTS)
+
+    if clients_need_refresh(clients, stale_api_call):
+        # the clients are built outside _WARM_CLIENTS_LOCK, records holding valid
+        # clients are not blocked by the Secret Manager call
+        with _WARM_CLIENTS_REFRESH_LOCK:
+            with _WARM_CLIENTS_LOCK:
+                clients = dict(_WARM_CLIENTS)
+
+            # another record may have refreshed the clients while this one waited
+            if clients_need_refresh(clients, stale_api_call):
+                clients = create_clients()
+
+                with _WARM_CLIENTS_LOCK:
+                    _WARM_CLIENTS.update(clients)
+    else:
+        LOGGER.debug("Reusing warm S3 bucket and DocDB objects.")
+
+    return clients["api_call"], clients["bucket_obj"]
+
+
+def clients_need_refresh(clients: dict, stale_api_call: NomiApiCall = None) -> bool:
+    """Function to check if the cached clients are missing, older than
+    API_TOKEN_TIME_LIMIT, or still hold the client that failed to authenticate.
+
+    Args:
+        clients (dict)
+        stale_api_call (NomiApiCall, optional). Defaults to None.
+
+    Returns:
+        bool
+    """
+    expired = (
+        not clients or monotonic() - clients["created_at"] > API_TOKEN_TIME_LIMIT
+    )
+    refresh = stale_api_call is not None and clients.get("api_call") is stale_api_call
+
+    return expired or refresh
+
+
+def is_auth_error(error: Exception) -> bool:
+    """Function to detect authentication failures from the DocDB API, by the HTTP
+    status carried by the error or by the errors it was raised from.
+
+    Args:
+        error (Exception)
+
+    Returns:
+        bool
+    """
+    while error is not None:
+        response = getattr(error, "response", None)
+        status_code = getattr(error, "status_code", getattr(response, "status_code", None))
+
+        if status_code in AUTH_ERROR_STATUS_CODES:
+            return True
+
+        error = error.__cause__
+
+    return False
 
 
 # {"type": "vaccine"/"test", "_id": "111", "payload": {}} - clarify with services which we'll be receiving _id or payload or both
 # use the encounter_id to call order endpoint to get back all orders (search endpoint) (only for testing since vax doesn't do orders)
 # update unit tests - QA
 
+def record_position_fields(record: dict) -> dict:
+    """Function to return the topic, partition and offset fields of a dictionary.
+
+    Args:
+        record (dict)
+
+    Returns:
+        dict
+    """
+    return {
+        "topic": record.get("topic"),
+        "partition": record.get("partition"),
+        "offset": record.get("offset"),
+    }
+
+
+def record_position(kafka_record: dict) -> dict:
+    """Function to return the Kafka topic, partition and offset of a record.
+
+    Args:
+        kafka_record (dict)
+
+    Returns:
+        dict
+    """
+    return record_position_fields(kafka_record["payload"])
+
+
+def is_later_record(record: tuple, other: tuple) -> bool:
+    """Function to compare two (index, payload) batch records by timestamp. Offsets only
+    order records of the same topic partition, otherwise the event order is kept.
+
+    Args:
+        record (tuple)
+        other (tuple)
+
+    Returns:
+        bool
+    """
+    index, payload = record
+    other_index, other_payload = other
+
+    timestamp = payload.get("timestamp") or 0
+    other_timestamp = other_payload.get("timestamp") or 0
+    if timestamp != other_timestamp:
+        return timestamp > other_timestamp
+
+    same_partition = (payload.get("topic"), payload.get("partition")) == (
+        other_payload.get("topic"),
+        other_payload.get("partition"),
+    )
+    if same_partition and payload.get("offset") != other_payload.get("offset"):
+        return (payload.get("offset") or 0) > (other_payload.get("offset") or 0)
+
+    return index > other_index
+
+
+def position_key(position: dict) -> tuple:
+    return position["topic"], position["partition"], position["offset"]
+
+
+def coalesce_records(event: list) -> Tuple[list, list]:
+    """Function to group the batch records by decoded key so each encounter is processed
+    once, using the latest record (see is_later_record). Records whose key can't be
+    decoded are kept as they are and fail on their own.
+
+    Args:
+        event (list)
+
+    Returns:
+        Tuple[list, list]: records to process in event order, collapsed record positions.
+    """
+    latest = {}
+    for index, kafka_record in enumerate(event):
+        payload = kafka_record["payload"]
+        try:
+            key = b64decode(payload["key"]).decode("utf-8")
+        except Exception:
+            key = index
+
+        record = (index, payload)
+        if key not in latest or is_later_record(record, latest[key]):
+            latest[key] = record
+
+    kept = sorted(index for index, _ in latest.values())
+    kept_by_key = {key: event[index] for key, (index, _) in latest.items()}
+    kept_set = set(kept)
+
+    collapsed = []
+    for index, kafka_record in enumerate(event):
+        if index in kept_set:
+            continue
+
+        key = b64decode(kafka_record["payload"]["key"]).decode("utf-8")
+        collapsed.append(
+            {
+                **record_position(kafka_record),
+                "coalesced_into": record_position(kept_by_key[key]),
+            }
+        )
+
+    if collapsed:
+        LOGGER.info(f"Collapsed {len(collapsed)} repeated Kafka records by key.")
+
+    return [event[index] for index in kept], collapsed
+
+
+def prefetch_batch(event: list, memo: dict, context=None) -> dict:
+    """Function to request the DocDB data of every encounter in the batch at once.
+    Failures are only logged, records missing from the result request their own data.
+
+    The prefetch takes at most PREFETCH_TIME_LIMIT_MS, and never the last
+    RECORD_TIME_RESERVE_MS of the lambda, which are left to process the records.
+
+    Args:
+        event (list)
+        memo (dict)
+        context (LambdaContext, optional). Defaults to None, no time limit.
+
+    Returns:
+        dict: encounter id mapped to its order payload.
+    """
+    time_left = remaining_time_ms(context)
+    timeout = None
+    if time_left is not None:
+        timeout = min(PREFETCH_TIME_LIMIT_MS, time_left - RECORD_TIME_RESERVE_MS) / 1000
+
+        if timeout <= 0:
+            LOGGER.warning(f"Lambda deadline close ({time_left} ms left), batch not prefetched.")
+            return {}
+
+    try:
+        api_call, _ = get_warm_clients()
+        encounter_ids = [
+            b64decode(kafka_record["payload"]["key"]).decode("utf-8")
+            for kafka_record in event
+        ]
+
+        return ApiRequest(NomiApiCall=api_call, memo=memo).get_batch_order_data(
+            encounter_ids, timeout=timeout
+        )
+
+    except Exception as e:
+        LOGGER.warning("Failed to prefetch batch data. Error: " + str(e))
+
+        return {}
+
+
+def process_record(
+    kafka_record: dict, memo: dict = None, batch_payload: dict = None
+) -> dict:
+    """Function to process a single Kafka record. Errors are isolated to the record
+    and reported in the returned outcome. On an authentication failure the warm
+    clients are refreshed and the record is retried once.
+
+    Args:
+        kafka_record (dict)
+        memo (dict, optional). DocDB documents shared by the batch. Defaults to None.
+        batch_payload (dict, optional). Prefetched order payloads by encounter id. Defaults to None.
+
+    Returns:
+        dict: record outcome with status, error and duration.
+    """
+    outcome = {
+        **record_position(kafka_record),
+        "_id": None,
+        "status": "success",
+        "error": None,
+    }
+    start = perf_counter()
+
+    with record_context(partition=outcome["partition"], offset=outcome["offset"]):
+        try:
+            _process_record(kafka_record, outcome, memo, batch_payload)
+        except Exception as e:
+            outcome["status"] = "failed"
+            outcome["error"] = str(e)
+            LOGGER.warning("HL7 message error. Error: " + str(e))
+        finally:
+            outcome["duration"] = perf_counter() - start
+
+    return outcome
+
+
+def _process_record(
+    kafka_record: dict, outcome: dict, memo: dict, batch_payload: dict
+) -> None:
+    """Function to generate the HL7 messages of a Kafka record, run by process_record
+    inside the record log context."""
+    payload = kafka_record["payload"]
+    LOGGER.info("Requesting data from Tiger.")
+
+    _id = b64decode(payload["key"]).decode("utf-8")
+    outcome["_id"] = _id
+    append_record_keys(_id=_id)
+    LOGGER.info("Calling Tiger API.")
+    api_call, bucket_obj = get_warm_clients()
+
+    try:
+        test.process(
+            kafka_record,
+            api_call,
+            bucket_obj,
+            memo=memo,
+            order_payload=(batch_payload or {}).get(_id),
+        )
+    except Exception as e:
+        if not is_auth_error(e):
+            raise
+
+        LOGGER.warning("Authentication failed, refreshing clients. Error: " + str(e))
+        api_call, bucket_obj = get_warm_clients(stale_api_call=api_call)
+        test.process(kafka_record, api_call, bucket_obj, memo=memo)
+    # TODO will need to uncomment this logic later.
+    # if kafka_record["payload"]["type"] == "vaccine":
+    #     vax.process(kafka_record, api_call, bucket_obj)
+    # else:
+    #     test.process(kafka_record, api_call, bucket_obj)
+
+
+def remaining_time_ms(context) -> Union[int, None]:
+    """Function to return the lambda remaining time, None outside the lambda runtime.
+
+    Args:
+        context (LambdaContext)
+
+    Returns:
+        Union[int, None]
+    """
+    if hasattr(context, "get_remaining_time_in_millis"):
+        return context.get_remaining_time_in_millis()
+
+    return None
+
+
+def run_records(event: list, context, process_func: Callable) -> Tuple[list, list]:
+    """Function to run the batch records on a bounded pool of workers. A record is only
+    started while the lambda has time left to finish it, which is the larger of
+    RECORD_TIME_RESERVE_MS and the slowest record seen so far.
+
+    Args:
+        event (list)
+        context (LambdaContext)
+        process_func (Callable): takes a Kafka record and returns its outcome.
+
+    Returns:
+        Tuple[list, list]: outcomes in event order, positions of the records not started.
+    """
+    outcomes = [None] * len(event)
+    unprocessed = []
+    in_flight = {}
+    slowest_record_ms = 0
+
+    def collect(futures):
+        nonlocal slowest_record_ms
+        for future in futures:
+            outcome = future.result()
+            outcomes[in_flight.pop(future)] = outcome
+            slowest_record_ms = max(slowest_record_ms, outcome["duration"] * 1000)
+
+    with ThreadPoolExecutor(max_workers=KAFKA_BATCH_MAX_WORKERS) as executor:
+        for index, kafka_record in enumerate(event):
+            if len(in_flight) >= KAFKA_BATCH_MAX_WORKERS:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            time_left = remaining_time_ms(context)
+            if time_left is not None and time_left < max(
+                RECORD_TIME_RESERVE_MS, slowest_record_ms
+            ):
+                unprocessed = [record_position(record) for record in event[index:]]
+                LOGGER.warning(
+                    f"Lambda deadline close ({time_left} ms left), {len(unprocessed)} records not started."
+                )
+                break
+
+            in_flight[executor.submit(process_func, kafka_record)] = index
+
+        collect(wait(list(in_flight)).done)
+
+    return [outcome for outcome in outcomes if outcome is not None], unprocessed
+
+
+def build_batch_response(
+    outcomes: list, unprocessed: list, collapsed: list = ()
+) -> dict:
+    """Function to build the per record response returned to the sink connector.
+    Only the records listed in batchItemFailures (failed or not started) need to be
+    retried, records that succeeded are not redelivered. Collapsed records get the
+    status and error of the record they were coalesced into, so they are redelivered
+    when it failed or was not started. Collapsed records of a record not started are
+    listed as unprocessed too.
+
+    Args:
+        outcomes (list)
+        unprocessed (list)
+        collapsed (list, optional). See coalesce_records. Defaults to ().
+
+    Returns:
+        dict
+    """
+    records = [
+        {
+            **record_position_fields(outcome),
+            "status": outcome["status"],
+            "error": outcome["error"],
+        }
+        for outcome in outcomes
+    ]
+    records += [
+        {**position, "status": "unprocessed", "error": None} for position in unprocessed
+    ]
+    outcomes_by_position = {position_key(record): record for record in records}
+    unprocessed = list(unprocessed)
+    for position in collapsed:
+        target = outcomes_by_position[position_key(position["coalesced_into"])]
+        records.append({**position, "status": target["status"], "error": target["error"]})
+
+        if target["status"] == "unprocessed":
+            unprocessed.append(record_position_fields(position))
+
+    batch_item_failures = [
+        {"itemIdentifier": record_position_fields(record)}
+        for record in records
+        if record["status"] in ("failed", "unprocessed")
+    ]
+
+    # records of this batch that are not redelivered thanks to partial batch failures,
+    # without failures nothing would have been redelivered anyway
+    reprocessing_saved = (
+        sum(record["status"] == "success" for record in records)
+        if batch_item_failures
+        else 0
+    )
+
+    return {
+        "batchItemFailures": batch_item_failures,
+        "records": records,
+        "unprocessed": unprocessed,
+        "collapsed": len(collapsed),
+        "reprocessing_saved": reprocessing_saved,
+    }
+
+
+def log_batch_summary(response: dict, total_time: float) -> None:
+    """Function to log the per record outcomes and the batch throughput.
+
+    Args:
+        response (dict): see build_batch_response.
+        total_time (float)
+    """
+    records = response["records"]
+    processed = [
+        record
+        for record in records
+        if record["status"] in ("success", "failed") and "coalesced_into" not in record
+    ]
+
+    LOGGER.info(
+        {
+            "message": "Kafka batch processed.",
+            "records": len(processed),
+            "succeeded": sum(record["status"] == "success" for record in processed),
+            "failed": sum(record["status"] == "failed" for record in processed),
+            "unprocessed": len(response["unprocessed"]),
+            "collapsed": response["collapsed"],
+            "reprocessing_saved": response["reprocessing_saved"],
+            "workers": KAFKA_BATCH_MAX_WORKERS,
+            "records_per_second": len(processed) / total_time if total_time else 0,
+            "docdb_cache": REFERENCE_CACHE.stats(),
+            "retries_left": RETRY_BUDGET.retries_left,
+            "retries_denied": RETRY_BUDGET.retries_denied,
+            "order_skips_warm_container": ORDER_SKIPS,
+            "outcomes": records,
+        }
+    )
+
+
 def lambda_handler(event, context):
     """Kafka AWS Lambda Sink Connector Payload
     [
@@ -56,42 +553,31 @@ def lambda_handler(event, context):
 
     try:
         start_lambda = perf_counter()
+        RETRY_BUDGET.reset(remaining_time_ms=remaining_time_ms(context))
 
-        LOGGER.info("Instantiating S3 bucket, DocDB and Secret Manager objects.")
-        secrets_manager = AwsSecretManager(SECRET_MANAGER_HL7_ARN)
-        token_tiger = secrets_manager.get_secret_token(secret_key="tiger_api_key")
+        get_warm_clients()
+        records, collapsed = coalesce_records(event=event)
+        batch_memo = {}
+        batch_payload = prefetch_batch(event=records, memo=batch_memo, context=context)
 
-        api_call = NomiApiCall(
-            endpoint_url=DOC_DB_BASE_URL,
-            oauth_token=f"Basic {token_tiger}",
-            oauth_base_url=DOCDB_OAUTH_BASE_URL,
-            max_attempts=API_RETRY,
-            timeout_time=APIS_TIMEOUT_TIME,
+        outcomes, unprocessed = run_records(
+            event=records,
+            context=context,
+            process_func=partial(
+                process_record, memo=batch_memo, batch_payload=batch_payload
+            ),
         )
 
-        bucket_obj = S3Bucket(DESTINATION_BUCKET)
-
-        for kafka_record in event:
-            try:
-
-                LOGGER.info("Requesting data from Tiger.")
-
-                _id = b64decode(kafka_record["payload"]["key"]).decode("utf-8")
-                LOGGER.append_keys(_id=_id)
-                LOGGER.info("Calling Tiger API.")
-                test.process(kafka_record, api_call, bucket_obj)
-                    # TODO will need to uncomment this logic later.
-                    # if kafka_record["payload"]["type"] == "vaccine": 
-                    #     vax.process(kafka_record, api_call, bucket_obj)
-                    # else:
-                    #     test.process(kafka_record, api_call, bucket_obj)
+        response = build_batch_response(
+            outcomes=outcomes, unprocessed=unprocessed, collapsed=collapsed
+        )
 
-            except Exception as e:
-                LOGGER.warning("HL7 message error. Error: " + str(e))
+        total_time = perf_counter() - start_lambda
+        log_batch_summary(response=response, total_time=total_time)
 
-        LOGGER.info(f"Total lambda execution time: {perf_counter() - start_lambda}")
+        LOGGER.info(f"Total lambda execution time: {total_time}")
         LOGGER.info("Lambda Finished Executing.")
-        return
+        return response
 
     except Exception as e:
         LOGGER.append_keys(
@@ -2,10 +2,11 @@ from time import perf_counter
 from base64 import b64decode
 from aws_lambda_powertools import Logger
 from dsl_utils.aws_wrappers.s3 import S3Bucket
-from hl7_objects import Hl7Record, MasterFileJson, StateDoh, RepeatedHl7MessageError
-from doc_db_mapper import ApiRequest
+from hl7_objects import Hl7Record, StateDoh, RepeatedHl7MessageError, load_master_file
+from doc_db_mapper import ApiRequest, count_order_skip
 from hl7_message_utils import create_message
 from state_level_validation_funcs import hl7_test_file_name
+from record_context import add_record_context_filter, append_record_keys
 from config import DEBUG_MODE
 
 LOGGER = Logger(service="dsl_hl7_kafka_order", level="DEBUG" if DEBUG_MODE else "INFO")
@@ -22,6 +23,7 @@ def set_logger_keys():
 
 
 set_logger_keys()
+add_record_context_filter(LOGGER)
 
 
 def file_extension(file_format: str) -> str:
@@ -75,7 +77,7 @@ def main(
     LOGGER.info("Grabbing master JSON.")
     try:
         message = Hl7Record(
-            record=hl7_message, logger=LOGGER, MasterFileJson=MasterFileJson()
+            record=hl7_message, logger=LOGGER, MasterFileJson=load_master_file()
         )
     except RepeatedHl7MessageError as e:
         LOGGER.warning("HL7 message error. Error: " + str(e))
@@ -97,7 +99,7 @@ def main(
     for doh in message.dohs:
 
         message.add_doh(input=doh)
-        LOGGER.append_keys(doh=[doh.title()])
+        append_record_keys(doh=[doh.title()])
         state_level_message_check = message.state_config_validation(state=doh)
 
         if state_level_message_check:
@@ -126,20 +128,26 @@ def main(
         LOGGER.info("HL7 message generation complete.")
         LOGGER.info("All steps run successfully.")
 
-    LOGGER.append_keys(doh=[doh.title() for doh in message.dohs])
+    append_record_keys(doh=[doh.title() for doh in message.dohs])
 
 
-def process(payload, api_call, bucket_obj):
+def process(payload, api_call, bucket_obj, memo: dict = None, order_payload: list = None):
     """Kafka AWS Lambda Sink Connector Payload"""
     _id = b64decode(payload["payload"]["key"]).decode("utf-8")
-    LOGGER.append_keys(encounter_id=_id)
-    api_request = ApiRequest(encounter_id=_id, NomiApiCall=api_call)
-    order_payload = api_request.get_order_data(_id)
+    append_record_keys(encounter_id=_id)
+    if order_payload is None:
+        api_request = ApiRequest(encounter_id=_id, NomiApiCall=api_call, memo=memo)
+        order_payload = api_request.get_order_data(_id)
     for order in order_payload:
-        LOGGER.append_keys(order_id=order["order"]["id"])
+        append_record_keys(order_id=order["order"]["id"])
         if order is None:
             LOGGER.warning("Lambda Finished Executing without generating message.")
             return
+        skip_reason = order.get("skip_reason")
+        if skip_reason is not None:
+            count_order_skip(skip_reason)
+            LOGGER.warning(f"Order does not require HL7 message: {skip_reason}.")
+            continue
         start = perf_counter()
         LOGGER.debug(order)
         LOGGER.info(f"Total time calling tiger api: {perf_counter()-start}")
@@ -2,10 +2,11 @@ from time import perf_counter
 from base64 import b64decode
 from aws_lambda_powertools import Logger
 from dsl_utils.aws_wrappers.s3 import S3Bucket
-from hl7_objects import Hl7Record, MasterFileJson, StateDoh, RepeatedHl7MessageError
+from hl7_objects import Hl7Record, StateDoh, RepeatedHl7MessageError, load_master_file
 from doc_db_mapper import ApiRequest
 from hl7_message_utils import create_message
 from state_level_validation_funcs import hl7_vax_file_name
+from record_context import add_record_context_filter, append_record_keys
 from config import DEBUG_MODE
 
 LOGGER = Logger(service="dsl_hl7_kafka_order", level="DEBUG" if DEBUG_MODE else "INFO")
@@ -21,6 +22,7 @@ def set_logger_keys():
 
 
 set_logger_keys()
+add_record_context_filter(LOGGER)
 
 
 def file_extension(file_format: str) -> str:
@@ -74,7 +76,7 @@ def main(
     LOGGER.info("Grabbing master JSON.")
     try:
         message = Hl7Record(
-            record=hl7_message, logger=LOGGER, MasterFileJson=MasterFileJson()
+            record=hl7_message, logger=LOGGER, MasterFileJson=load_master_file()
         )
     except RepeatedHl7MessageError as e:
         LOGGER.warning("HL7 message error. Error: " + str(e))
@@ -96,7 +98,7 @@ def main(
     for index, doh in enumerate(message.dohs):
 
         message.add_doh(input=doh)
-        LOGGER.append_keys(doh=[doh.title()])
+        append_record_keys(doh=[doh.title()])
         state_level_message_check = message.state_config_validation(state=doh)
 
         if state_level_message_check:
@@ -126,14 +128,14 @@ def main(
         LOGGER.info("HL7 message generation complete.")
         LOGGER.info("All steps run successfully.")
 
-    LOGGER.append_keys(doh=[doh.title() for doh in message.dohs])
+    append_record_keys(doh=[doh.title() for doh in message.dohs])
 
 
 # TODO might need to process multiple orders. Double check this.
-def process(payload, api_call, bucket_obj):
+def process(payload, api_call, bucket_obj, memo: dict = None):
     """Kafka AWS Lambda Sink Connector Payload"""
     _id = b64decode(payload["payload"]["key"]).decode("utf-8")
-    api_request = ApiRequest(encounter_id=_id, NomiApiCall=api_call)
+    api_request = ApiRequest(encounter_id=_id, NomiApiCall=api_call, memo=memo)
     encounter_payload = api_request.get_encounter_data(_id)
     if encounter_payload is None:
         LOGGER.warning(
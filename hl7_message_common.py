@@ -0,0 +1,378 @@
+from pathlib import Path
+from string import Template
+from typing import Callable, Union
+
+from dsl_utils.utils import path_join
+from dsl_utils.utils import clean_str
+
+# normalized table indexes, by (table name, json_key, comparison_operator)
+_TABLE_INDEXES = {}
+TABLE_INDEXES_MAX_ENTRIES = 256
+
+# race/ethnicity master file rows, by (kind, normalized value)
+_DEMOGRAPHICS = {}
+DEMOGRAPHICS_MAX_ENTRIES = 1024
+# race/ethnicity field -> master file row key
+DEMOGRAPHIC_FIELDS = {"code": "value", "desc": "desc", "system": "system"}
+# arguments of every segment renderer, in block function parameter order
+RENDERER_ARGS = ("data", "doh_json", "master_file_obj")
+
+
+def load_file_template(template_base: Path, file_name: str) -> str:
+    """Function to load a template file of the template_base directory.
+
+    Args:
+        template_base (Path)
+        file_name (str)
+
+    Returns:
+        str
+    """
+    with open(path_join(template_base, file_name), "r") as file:
+        return file.read()
+
+
+def load_template_registry(template_base: Path, template_names: tuple) -> dict:
+    """Function to load and compile every template once. Missing templates or templates
+    with invalid placeholders raise when the module is imported instead of mid-message.
+
+    Args:
+        template_base (Path)
+        template_names (tuple)
+
+    Raises:
+        ValueError: if a template has an invalid placeholder.
+
+    Returns:
+        dict
+    """
+    registry = {}
+
+    for template_name in template_names:
+        template = Template(load_file_template(template_base, template_name))
+
+        for match in template.pattern.finditer(template.template):
+            if match.group("invalid") is not None:
+                raise ValueError(
+                    f"Invalid placeholder in template {template_name} at position {match.start('invalid')}"
+                )
+
+        registry[template_name] = template
+
+    return registry
+
+
+def normalize_table_value(value: str) -> str:
+    return clean_str(value).replace(" ", "")
+
+
+def table_index(
+    table_to_iterate: list,
+    json_key: str,
+    comparison_operator: str,
+    table_name: str = None,
+) -> dict:
+    """Function to return the normalized hash index of a table.
+    "in" tables are indexed by every alias listed under json_key, "==" tables by the
+    json_key value. Rows without json_key are skipped. The first matching row wins,
+    as in a linear scan.
+
+    Named tables are indexed once and the index is kept until a different table is
+    loaded under the same name. Unnamed tables are indexed on every call.
+
+    Tables come from the master file and DOH json files and must not be modified.
+
+    Args:
+        table_to_iterate (list)
+        json_key (str)
+        comparison_operator (str): cleaned operator.
+        table_name (str, optional). Defaults to None.
+
+    Returns:
+        dict
+    """
+    key = (table_name, json_key, comparison_operator)
+
+    cached = _TABLE_INDEXES.get(key) if table_name is not None else None
+    if cached is not None and cached[0] is table_to_iterate:
+        return cached[1]
+
+    index = {}
+    for test in table_to_iterate:
+        if json_key not in test:
+            continue
+
+        if comparison_operator == "in":
+            for alias in test[json_key]:
+                index.setdefault(normalize_table_value(alias), test)
+
+        if comparison_operator == "==":
+            index.setdefault(normalize_table_value(test[json_key]), test)
+
+    if table_name is not None:
+        if len(_TABLE_INDEXES) >= TABLE_INDEXES_MAX_ENTRIES:
+            _TABLE_INDEXES.clear()
+        _TABLE_INDEXES[key] = (table_to_iterate, index)
+
+    return index
+
+
+def find_table_row(
+    value_to_check: str,
+    table_to_iterate: list,
+    comparison_operator: str,
+    json_key: str = "databus_name",
+    table_name: str = None,
+) -> Union[dict, None]:
+    """Function to find the table row matching value_to_check, None if there is no match.
+
+    Args:
+        value_to_check (str)
+        table_to_iterate (list)
+        comparison_operator (str)
+        json_key (str, optional). Defaults to "databus_name".
+        table_name (str, optional). Name the table index is kept under, see table_index. Defaults to None.
+
+    Returns:
+        Union[dict, None]
+    """
+    return table_index(
+        table_to_iterate=table_to_iterate,
+        json_key=json_key,
+        comparison_operator=clean_str(comparison_operator),
+        table_name=table_name,
+    ).get(normalize_table_value(value_to_check))
+
+
+def patient_table_mapper(
+    value_to_check: str,
+    table_to_iterate: list,
+    return_key: str,
+    comparison_operator: str,
+    default_value: str = None,
+    raise_error: Exception = None,
+    json_key: str = "databus_name",
+    table_name: str = None,
+) -> str:
+    """Function to map different tables to the argument value_to_check.
+
+    Args:
+        value_to_check (str)
+        table_to_iterate (list)
+        return_key (str)
+        comparison_operator (str)
+        default_value (str, optional). Defaults to None.
+        raise_error (Exception, optional). Defaults to None.
+        json_key (str, optional). Defines the key to use to filter the differnt json files. Defaults to "databus_name".
+        table_name (str, optional). Name the table index is kept under, see table_index. Defaults to None.
+
+    Raises:
+        raise_error: If no condition is met, an optional error can be raised.
+        ValueError: If no condition is met and no default values or errors are given.
+
+    Returns:
+        str
+    """
+    test = find_table_row(
+        value_to_check=value_to_check,
+        table_to_iterate=table_to_iterate,
+        comparison_operator=comparison_operator,
+        json_key=json_key,
+        table_name=table_name,
+    )
+
+    if test is not None:
+        return test[return_key]
+
+    if raise_error is not None:
+        raise raise_error
+    elif default_value is not None:
+        return default_value
+    else:
+        raise ValueError("Not raise error or default value specified.")
+
+
+def find_demographic_row(
+    kind: str, value: str, master_file_table: list
+) -> Union[dict, None]:
+    """Function to find the master file row of a patient race or ethnicity, None if the
+    value is not mapped. Rows are memoized per (kind, normalized value) until the
+    master file table changes.
+
+    Args:
+        kind (str): "race" or "ethnicity".
+        value (str)
+        master_file_table (list): master file race_table or ethnicity_table.
+
+    Returns:
+        Union[dict, None]
+    """
+    value = value.lower()
+    key = (kind, normalize_table_value(value))
+
+    cached = _DEMOGRAPHICS.get(key)
+    if cached is not None and cached[0] is master_file_table:
+        return cached[1]
+
+    row = find_table_row(
+        value_to_check=value,
+        table_to_iterate=master_file_table,
+        comparison_operator="in",
+        table_name=f"{kind}_table",
+    )
+
+    if len(_DEMOGRAPHICS) >= DEMOGRAPHICS_MAX_ENTRIES:
+        _DEMOGRAPHICS.clear()
+    _DEMOGRAPHICS[key] = (master_file_table, row)
+
+    return row
+
+
+def resolve_demographic(
+    kind: str,
+    value: str,
+    doh_json: dict,
+    master_file_table: list,
+    fields: tuple = ("code", "desc", "system"),
+) -> tuple:
+    """Function to resolve the fields of a patient race or ethnicity with one master
+    file lookup, falling back to the DOH default of each field when the value is not
+    mapped. Defaults are only read for unmapped values.
+
+    Args:
+        kind (str): "race" or "ethnicity".
+        value (str)
+        doh_json (dict)
+        master_file_table (list): master file race_table or ethnicity_table.
+        fields (tuple, optional): code, desc and/or system. Defaults to all three.
+
+    Raises:
+        ValueError: If the value is not mapped and the DOH has no default for a field.
+
+    Returns:
+        tuple: the resolved values, in fields order.
+    """
+    row = find_demographic_row(
+        kind=kind, value=value, master_file_table=master_file_table
+    )
+
+    if row is not None:
+        return tuple(row[DEMOGRAPHIC_FIELDS[field]] for field in fields)
+
+    resolved = []
+    for field in fields:
+        default_value = doh_json["specific_values"][f"default_{kind}_{field}"]
+
+        if default_value is None:
+            raise ValueError(
+                f"Not raise error or default value specified: default_{kind}_{field}."
+            )
+
+        resolved.append(default_value)
+
+    return tuple(resolved)
+
+
+def segment_arg_names(
+    segment: str, segment_args: dict, no_args_segments: tuple
+) -> tuple:
+    """Function to get the names of the arguments a block function requires, in
+    RENDERER_ARGS order.
+
+    Args:
+        segment (str)
+        segment_args (dict): block function argument -> segments that require it.
+        no_args_segments (tuple)
+
+    Returns:
+        tuple
+    """
+    if segment in no_args_segments:
+        return ()
+
+    return tuple(
+        name for name in RENDERER_ARGS if segment in segment_args.get(name, ())
+    )
+
+
+# block function arguments -> renderer taking (data, doh_json, master_file_obj) that
+# passes them positionally, so rendering a segment is a single direct call
+SEGMENT_CALLS = {
+    (): lambda func: lambda data, doh_json, master_file_obj: func(),
+    ("data",): lambda func: lambda data, doh_json, master_file_obj: func(data),
+    ("doh_json",): lambda func: lambda data, doh_json, master_file_obj: func(doh_json),
+    ("master_file_obj",): lambda func: lambda data, doh_json, master_file_obj: func(
+        master_file_obj
+    ),
+    ("data", "doh_json"): lambda func: lambda data, doh_json, master_file_obj: func(
+        data, doh_json
+    ),
+    ("data", "master_file_obj"): lambda func: lambda data, doh_json, master_file_obj: func(
+        data, master_file_obj
+    ),
+    ("doh_json", "master_file_obj"): lambda func: lambda data, doh_json, master_file_obj: func(
+        doh_json, master_file_obj
+    ),
+    ("data", "doh_json", "master_file_obj"): lambda func: lambda data, doh_json, master_file_obj: func(
+        data, doh_json, master_file_obj
+    ),
+}
+
+
+def bind_segment_function(func: Callable, arg_names: tuple) -> Callable:
+    """Function to bind a block function to the arguments it requires. The returned
+    renderer always takes (data, doh_json, master_file_obj) and passes the required
+    ones positionally, in the order of arg_names.
+
+    Args:
+        func (Callable)
+        arg_names (tuple)
+
+    Raises:
+        ValueError: if arg_names is not a supported argument shape.
+
+    Returns:
+        Callable
+    """
+    try:
+        bind = SEGMENT_CALLS[arg_names]
+    except KeyError:
+        raise ValueError(f"Block function arguments not supported: {arg_names}")
+
+    return bind(func)
+
+
+def build_message_plan(
+    segment_list: tuple,
+    segment_functions: dict,
+    segment_args: dict,
+    no_args_segments: tuple,
+) -> tuple:
+    """Function to compile a DOH segment list into a plan of bound renderers.
+
+    Args:
+        segment_list (tuple)
+        segment_functions (dict): segment -> block function.
+        segment_args (dict): block function argument -> segments that require it.
+        no_args_segments (tuple)
+
+    Raises:
+        Exception: if a segment is not mapped, reporting the segment name.
+
+    Returns:
+        tuple: (segment, renderer) pairs.
+    """
+    plan = []
+
+    for seg in segment_list:
+        try:
+            func = segment_functions[seg]
+        except KeyError:
+            raise Exception(
+                f"Error building HL7 message - segment: {seg}: HL7 message block function not implemented."
+            )
+
+        arg_names = segment_arg_names(seg, segment_args, no_args_segments)
+        plan.append((seg, bind_segment_function(func, arg_names)))
+
+    return tuple(plan)
@@ -1,17 +1,28 @@
 from pathlib import Path
+from functools import lru_cache
 from string import Template
-from typing import Callable
+from typing import Callable, Union
 
 from aws_lambda_powertools import Logger
-from dsl_utils.utils import path_join
 from dsl_utils.utils import clean_str
+from record_context import add_record_context_filter
+from hl7_message_common import (
+    TABLE_INDEXES_MAX_ENTRIES,
+    build_message_plan,
+    find_table_row,
+    load_file_template,
+    load_template_registry,
+    patient_table_mapper,
+    resolve_demographic,
+    segment_arg_names,
+)
 
 
 class Hl7Record:
     pass
 
 
-TEMPLATE_BASE = Path("templates")
+TEMPLATE_BASE = Path(__file__).parent / "templates"
 MSH_TEMPLATE = "msh.txt"
 SFT_TEMPLATE = "sft.txt"
 NTE_TEMPLATE = "nte.txt"
@@ -20,8 +31,22 @@ OBX_TEMPLATE = "obx.txt"
 ORC_TEMPLATE = "orc.txt"
 PID_TEMPLATE = "pid.txt"
 SPM_TEMPLATE = "spm.txt"
+TEMPLATE_NAMES = (
+    MSH_TEMPLATE,
+    SFT_TEMPLATE,
+    NTE_TEMPLATE,
+    OBR_TEMPLATE,
+    OBX_TEMPLATE,
+    ORC_TEMPLATE,
+    PID_TEMPLATE,
+    SPM_TEMPLATE,
+)
 
 logger = Logger(service="hl7_message_utils")
+add_record_context_filter(logger)
+
+# assay profiles, by (test_list name, assay)
+_ASSAY_PROFILES = {}
 
 
 def apply_ssn_logic(ssn: str, doh_json: dict) -> str:
@@ -50,8 +75,7 @@ def loadFileTemplate(fileName: str) -> str:
     Returns:
         str
     """
-    with open(path_join(TEMPLATE_BASE, fileName), "r") as file:
-        return file.read()
+    return load_file_template(TEMPLATE_BASE, fileName)
 
 
 def imprintTemplate(template_name: str, value_dict: dict) -> Template:
@@ -64,312 +88,174 @@ def imprintTemplate(template_name: str, value_dict: dict) -> Template:
     Returns:
         Template
     """
-    sectionTemplate = loadFileTemplate(template_name)
-    hl7Section = Template(sectionTemplate).substitute(value_dict)
-
-    return hl7Section
+    return TEMPLATES[template_name].substitute(value_dict)
 
 
-def patient_table_mapper(
-    value_to_check: str,
-    table_to_iterate: list,
-    return_key: str,
-    comparison_operator: str,
-    default_value: str = None,
-    raise_error: Exception = None,
-    json_key: str = "databus_name",
-) -> str:
-    """Function to map different tables to the argument value_to_check.
-
-    Args:
-        value_to_check (str)
-        table_to_iterate (list)
-        return_key (str)
-        comparison_operator (str)
-        default_value (str, optional). Defaults to None.
-        raise_error (Exception, optional). Defaults to None.
-        json_key (str, optional). Defines the key to use to filter the differnt json files. Defaults to "databus_name".
-
-    Raises:
-        raise_error: If no condition is met, an optional error can be raised.
-        ValueError: If no condition is met and no default values or errors are given.
-
-    Returns:
-        str
-    """
-    for test in table_to_iterate:
-
-        if clean_str(comparison_operator) == "in":
-            if clean_str(value_to_check).replace(" ", "") in [
-                clean_str(_).replace(" ", "") for _ in test[json_key]
-            ]:
-                return test[return_key]
-
-        if clean_str(comparison_operator) == "==":
-            if clean_str(value_to_check).replace(" ", "") == clean_str(
-                test[json_key]
-            ).replace(" ", ""):
-                return test[return_key]
-
-    if raise_error is not None:
-        raise raise_error
-    elif default_value is not None:
-        return default_value
-    else:
-        raise ValueError("Not raise error or default value specified.")
-
-
-def master_json_result_mapper(
-    result_value: str,
-    result_name: str,
-    procedure_type_ids: str,
-    master_file_results_table: list,
-    default_value: str,
-    return_key: str,
-):
-
-    result_value = clean_str(result_value)
-    result_name = clean_str(result_name)
-    procedure_type_ids = clean_str(procedure_type_ids[0])
-
-    if result_value in ["positive", "negative"]:
-
-        if result_name in ["c19", "monkeypox"]:
-            return master_file_results_table[result_value][result_name][return_key]
-        else:
-            return master_file_results_table[result_value][result_name][
-                procedure_type_ids
-            ][return_key]
-    else:
-        return default_value
+TEMPLATES = load_template_registry(TEMPLATE_BASE, TEMPLATE_NAMES)
 
 
 # ****************** Json Master File and DOH Json mappers ***********************
-def map_abnormal_flag(
-    result_value: str,
-    result_name: str,
-    procedure_type_ids: str,
-    master_file_results_table: list,
-) -> str:
-    return master_json_result_mapper(
-        result_value=result_value,
-        result_name=result_name,
-        procedure_type_ids=procedure_type_ids,
-        master_file_results_table=master_file_results_table,
-        default_value="N",
-        return_key="abnormal_flag",
-    )
+class AssayProfile:
+    """Class to hold the DOH test_list row resolved for an assay. Each field raises the
+    same error as its mapper function when the assay or the field is not mapped."""
 
+    __slots__ = ("assay", "test")
 
-def map_abnormal_desc(
-    result_value: str,
-    result_name: str,
-    procedure_type_ids: str,
-    master_file_results_table: list,
-) -> str:
-    return master_json_result_mapper(
-        result_value=result_value,
-        result_name=result_name,
-        procedure_type_ids=procedure_type_ids,
-        master_file_results_table=master_file_results_table,
-        default_value="Normal",
-        return_key="abnormal_desc",
-    )
+    def __init__(self, assay: str, test: Union[dict, None]):
+        self.assay = assay
+        self.test = test
 
+    def _field(self, return_key: str, description: str):
+        if self.test is None:
+            raise Exception(f"UNABLE TO MAP TEST TO {description}: " + self.assay)
 
-def map_result_description(
-    result_value: str,
-    result_name: str,
-    procedure_type_ids: str,
-    master_file_results_table: list,
-) -> str:
-    return master_json_result_mapper(
-        result_value=result_value,
-        result_name=result_name,
-        procedure_type_ids=procedure_type_ids,
-        master_file_results_table=master_file_results_table,
-        default_value="Invalid result",
-        return_key="desc",
-    )
+        return self.test[return_key]
 
+    def loinc_code(self, result_name: str) -> str:
+        loinc_code_data = self._field("loinc_code", "LOINC CODE")
 
-def map_result_snomed(
-    result_value: str,
-    result_name: str,
-    procedure_type_ids: str,
-    master_file_results_table: list,
-) -> str:
-    return master_json_result_mapper(
-        result_value=result_value,
-        result_name=result_name,
-        procedure_type_ids=procedure_type_ids,
-        master_file_results_table=master_file_results_table,
-        default_value="455371000124106",
-        return_key="snomed",
-    )
+        if isinstance(loinc_code_data, dict):
+            return loinc_code_data[clean_str(result_name)]
 
+        return loinc_code_data
 
-def LOINC_Code(assay: str, doh_test_list: list, result_name: str) -> str:
-    loinc_code_data = patient_table_mapper(
-        value_to_check=assay,
-        table_to_iterate=doh_test_list,
-        return_key="loinc_code",
-        raise_error=Exception("UNABLE TO MAP TEST TO LOINC CODE: " + assay),
-        comparison_operator="==",
-        json_key="assay",
-    )
+    @property
+    def obs_method(self) -> str:
+        return self._field("obs_method", "OBSERVATION METHOD")
 
-    if isinstance(loinc_code_data, dict):
-        return loinc_code_data[clean_str(result_name)]
+    @property
+    def spec_type(self) -> str:
+        return self._field("spec_type", "SPECIMEN TYPE")
 
-    return loinc_code_data
+    @property
+    def spec_source(self) -> str:
+        return self._field("spec_source", "SPECIMEN SOURCE")
 
+    @property
+    def spec_source_obr(self) -> str:
+        return self._field("spec_source_obr", "SPECIMEN SOURCE OBR")
 
-def observ_method(assay: str, doh_test_list: list) -> str:
-    return patient_table_mapper(
-        value_to_check=assay,
-        table_to_iterate=doh_test_list,
-        return_key="obs_method",
-        raise_error=Exception("UNABLE TO MAP TEST TO OBSERVATION METHOD: " + assay),
-        comparison_operator="==",
-        json_key="assay",
-    )
+    @property
+    def site_name(self) -> str:
+        return self._field("site_name", "SPECIMEN SITE")
 
+    @property
+    def site_code(self) -> str:
+        return self._field("site_code", "SPECIMEN SITE CODE")
 
-def specimen_type(assay: str, doh_test_list: list) -> str:
-    return patient_table_mapper(
-        value_to_check=assay,
-        table_to_iterate=doh_test_list,
-        return_key="spec_type",
-        raise_error=Exception("UNABLE TO MAP TEST TO SPECIMEN TYPE: " + assay),
-        comparison_operator="==",
-        json_key="assay",
-    )
+    @property
+    def clia_number(self) -> str:
+        return self._field("clia_number", "CLIA NUMBER")
 
 
-def specimen_source(assay: str, doh_test_list: list) -> str:
-    return patient_table_mapper(
-        value_to_check=assay,
-        table_to_iterate=doh_test_list,
-        return_key="spec_source",
-        raise_error=Exception("UNABLE TO MAP TEST TO SPECIMEN SOURCE: " + assay),
-        comparison_operator="==",
-        json_key="assay",
-    )
-
-
-def specimen_source_obr(assay: str, doh_test_list: list) -> str:
-    return patient_table_mapper(
-        value_to_check=assay,
-        table_to_iterate=doh_test_list,
-        return_key="spec_source_obr",
-        raise_error=Exception("UNABLE TO MAP TEST TO SPECIMEN SOURCE OBR: " + assay),
-        comparison_operator="==",
-        json_key="assay",
-    )
-
-
-def specimen_site(assay: str, doh_test_list: list) -> str:
-    return patient_table_mapper(
-        value_to_check=assay,
-        table_to_iterate=doh_test_list,
-        return_key="site_name",
-        raise_error=Exception("UNABLE TO MAP TEST TO SPECIMEN SITE: " + assay),
-        comparison_operator="==",
-        json_key="assay",
-    )
+def resolve_assay_profile(
+    assay: str, doh_test_list: list, table_name: str = None
+) -> AssayProfile:
+    """Function to return the AssayProfile of an assay in a DOH test_list. Profiles of
+    a named test_list are resolved once per (table_name, assay) and shared by every
+    record, until a different test_list is loaded under the same name.
 
+    Args:
+        assay (str)
+        doh_test_list (list)
+        table_name (str, optional). e.g. "<doh>.test_list". Defaults to None.
 
-def site_code(assay: str, doh_test_list: list) -> str:
-    return patient_table_mapper(
-        value_to_check=assay,
-        table_to_iterate=doh_test_list,
-        return_key="site_code",
-        raise_error=Exception("UNABLE TO MAP TEST TO SPECIMEN SITE CODE: " + assay),
-        comparison_operator="==",
-        json_key="assay",
+    Returns:
+        AssayProfile
+    """
+    key = (table_name, assay)
+
+    cached = _ASSAY_PROFILES.get(key) if table_name is not None else None
+    if cached is not None and cached[0] is doh_test_list:
+        return cached[1]
+
+    profile = AssayProfile(
+        assay=assay,
+        test=find_table_row(
+            value_to_check=assay,
+            table_to_iterate=doh_test_list,
+            comparison_operator="==",
+            json_key="assay",
+            table_name=table_name,
+        ),
     )
 
+    if table_name is not None:
+        if len(_ASSAY_PROFILES) >= TABLE_INDEXES_MAX_ENTRIES:
+            _ASSAY_PROFILES.clear()
+        _ASSAY_PROFILES[key] = (doh_test_list, profile)
 
-def test_clia(assay: str, doh_test_list: list):
-    return patient_table_mapper(
-        value_to_check=assay,
-        table_to_iterate=doh_test_list,
-        return_key="clia_number",
-        raise_error=Exception("UNABLE TO MAP TEST TO CLIA NUMBER: " + assay),
-        comparison_operator="==",
-        json_key="assay",
-    )
+    return profile
 
 
 def convertPatientEthnicity(
     ethnicity: str, doh_json: dict, mater_file_ethnicity_table: list
 ) -> str:
-    return patient_table_mapper(
-        value_to_check=ethnicity.lower(),
-        table_to_iterate=mater_file_ethnicity_table,
-        return_key="value",
-        default_value=doh_json["specific_values"]["default_ethnicity_code"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="ethnicity",
+        value=ethnicity,
+        doh_json=doh_json,
+        master_file_table=mater_file_ethnicity_table,
+        fields=("code",),
+    )[0]
 
 
 def convertPatientEthnicityDesc(
     ethnicity: str, doh_json: dict, mater_file_ethnicity_table: list
 ) -> str:
-    return patient_table_mapper(
-        value_to_check=ethnicity.lower(),
-        table_to_iterate=mater_file_ethnicity_table,
-        return_key="desc",
-        default_value=doh_json["specific_values"]["default_ethnicity_desc"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="ethnicity",
+        value=ethnicity,
+        doh_json=doh_json,
+        master_file_table=mater_file_ethnicity_table,
+        fields=("desc",),
+    )[0]
 
 
 def convertPatientEthnicitySystem(
     ethnicity: str, doh_json: dict, mater_file_ethnicity_table: list
 ) -> str:
-    return patient_table_mapper(
-        value_to_check=ethnicity.lower(),
-        table_to_iterate=mater_file_ethnicity_table,
-        return_key="system",
-        default_value=doh_json["specific_values"]["default_ethnicity_system"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="ethnicity",
+        value=ethnicity,
+        doh_json=doh_json,
+        master_file_table=mater_file_ethnicity_table,
+        fields=("system",),
+    )[0]
 
 
 def convertPatientRace(race: str, doh_json: dict, master_file_race_table: list) -> str:
-    return patient_table_mapper(
-        value_to_check=race.lower(),
-        table_to_iterate=master_file_race_table,
-        return_key="value",
-        default_value=doh_json["specific_values"]["default_race_code"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="race",
+        value=race,
+        doh_json=doh_json,
+        master_file_table=master_file_race_table,
+        fields=("code",),
+    )[0]
 
 
 def convertPatientRaceDesc(
     race: str, doh_json: dict, master_file_race_table: list
 ) -> str:
-    return patient_table_mapper(
-        value_to_check=race.lower(),
-        table_to_iterate=master_file_race_table,
-        return_key="desc",
-        default_value=doh_json["specific_values"]["default_race_desc"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="race",
+        value=race,
+        doh_json=doh_json,
+        master_file_table=master_file_race_table,
+        fields=("desc",),
+    )[0]
 
 
 def convertPatientRaceSystem(
     race: str, doh_json: dict, master_file_race_table: list
 ) -> str:
-    return patient_table_mapper(
-        value_to_check=race.lower(),
-        table_to_iterate=master_file_race_table,
-        return_key="system",
-        default_value=doh_json["specific_values"]["default_race_system"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="race",
+        value=race,
+        doh_json=doh_json,
+        master_file_table=master_file_race_table,
+        fields=("system",),
+    )[0]
 
 
 def createSFTBlock(doh_json: dict) -> Template:
@@ -429,34 +315,27 @@ def createOBRBlock(data: Hl7Record, doh_json: dict, master_file_obj) -> Template
 
         try:
 
-            segment = "loinc_code"
-            loinc_code = LOINC_Code(
+            segment = "assay_profile"
+            assay_profile = resolve_assay_profile(
                 assay=data.test_kit_types["assay"],
                 doh_test_list=doh_json["test_list"],
-                result_name=order_result_value["result_name"],
+                table_name=f"{data.doh}.test_list",
             )
 
-            segment = "results_desc"
-            results_desc = map_result_description(
-                result_value=order_result_value["result"],
-                result_name=order_result_value["result_name"],
-                procedure_type_ids=data.test_kit_types["procedure_type_ids"],
-                master_file_results_table=master_file_obj.result_table,
+            segment = "loinc_code"
+            loinc_code = assay_profile.loinc_code(
+                result_name=order_result_value["result_name"]
             )
 
-            segment = "results_snomed"
-            results_snomed = map_result_snomed(
+            segment = "result_profile"
+            result_profile = master_file_obj.find_result_profile(
                 result_value=order_result_value["result"],
                 result_name=order_result_value["result_name"],
                 procedure_type_ids=data.test_kit_types["procedure_type_ids"],
-                master_file_results_table=master_file_obj.result_table,
             )
 
             segment = "spec_source_obr"
-            spec_source_obr = specimen_source_obr(
-                assay=data.test_kit_types["assay"],
-                doh_test_list=doh_json["test_list"],
-            )
+            spec_source_obr = assay_profile.spec_source_obr
 
         except Exception as e:
             raise type(e)(f"Failed extracting variable - var: {segment}. Error:{e}")
@@ -465,9 +344,9 @@ def createOBRBlock(data: Hl7Record, doh_json: dict, master_file_obj) -> Template
             "order_number": data.get_test_kit_id(),
             "filler_order_number": data.get_mrn(),
             "LOINC": loinc_code,
-            "result_snomed": results_snomed,
+            "result_snomed": result_profile.snomed,
             "result_date": data.str_results_date_time(),
-            "result_desc": results_desc,
+            "result_desc": result_profile.desc,
             "collection_date_time": data.str_collection_date_time(),
             "NPI_Number": doh_json["specific_values"]["NPI_Number"],
             "spec_source_obr": spec_source_obr,
@@ -507,54 +386,30 @@ def createOBXBlock(
 
         try:
 
-            segment = "loinc_code"
-            loinc_code = LOINC_Code(
+            segment = "assay_profile"
+            assay_profile = resolve_assay_profile(
                 assay=data.test_kit_types["assay"],
                 doh_test_list=doh_json["test_list"],
-                result_name=order_result_value["result_name"],
-            )
-
-            segment = "results_desc"
-            results_desc = map_result_description(
-                result_value=order_result_value["result"],
-                result_name=order_result_value["result_name"],
-                procedure_type_ids=data.test_kit_types["procedure_type_ids"],
-                master_file_results_table=master_file_obj.result_table,
-            )
-
-            segment = "results_snomed"
-            results_snomed = map_result_snomed(
-                result_value=order_result_value["result"],
-                result_name=order_result_value["result_name"],
-                procedure_type_ids=data.test_kit_types["procedure_type_ids"],
-                master_file_results_table=master_file_obj.result_table,
+                table_name=f"{data.doh}.test_list",
             )
 
-            segment = "abnormal_flag"
-            abnormal_flag = map_abnormal_flag(
-                result_value=order_result_value["result"],
-                result_name=order_result_value["result_name"],
-                procedure_type_ids=data.test_kit_types["procedure_type_ids"],
-                master_file_results_table=master_file_obj.result_table,
+            segment = "loinc_code"
+            loinc_code = assay_profile.loinc_code(
+                result_name=order_result_value["result_name"]
             )
 
-            segment = "abnormal_dect"
-            abnormal_dect = map_abnormal_desc(
+            segment = "result_profile"
+            result_profile = master_file_obj.find_result_profile(
                 result_value=order_result_value["result"],
                 result_name=order_result_value["result_name"],
                 procedure_type_ids=data.test_kit_types["procedure_type_ids"],
-                master_file_results_table=master_file_obj.result_table,
             )
 
             segment = "test_clia"
-            test_clia_var = test_clia(
-                assay=data.test_kit_types["assay"], doh_test_list=doh_json["test_list"]
-            )
+            test_clia_var = assay_profile.clia_number
 
             segment = "obs_method"
-            obs_method = observ_method(
-                assay=data.test_kit_types["assay"], doh_test_list=doh_json["test_list"]
-            )
+            obs_method = assay_profile.obs_method
 
         except Exception as e:
             raise type(e)(f"Failed extracting variable - var: {segment}. Error:{e}")
@@ -562,10 +417,10 @@ def createOBXBlock(
             "LOINC": loinc_code,
             "collection_date_time": data.str_collection_date_time(),
             "results_date_time": data.str_results_date_time(),
-            "result_desc": results_desc,
-            "result_snomed": results_snomed,
-            "abnormal_flag": abnormal_flag,
-            "abnormal_desc": abnormal_dect,
+            "result_desc": result_profile.desc,
+            "result_snomed": result_profile.snomed,
+            "abnormal_flag": result_profile.abnormal_flag,
+            "abnormal_desc": result_profile.abnormal_desc,
             "abnormal_flag_suffix": doh_json["specific_values"]["abnormal_flag_suffix"],
             "NPI_Number": doh_json["specific_values"]["NPI_Number"],
             "obx_23_7": doh_json["specific_values"]["obx_23_7"],
@@ -652,41 +507,23 @@ def createPIDBlock(data: Hl7Record, doh_json: dict, master_file_obj) -> Template
         )
 
         segment = "patient_race"
-        patient_race = convertPatientRace(
-            race=data.get_optional_patient_personal_info(field="race"),
-            doh_json=doh_json,
-            master_file_race_table=master_file_obj.race_table,
-        )
-        segment = "patient_race_desc"
-        patient_race_desc = convertPatientRaceDesc(
-            race=data.get_optional_patient_personal_info(field="race"),
-            doh_json=doh_json,
-            master_file_race_table=master_file_obj.race_table,
-        )
-        segment = "patient_race_system"
-        patient_race_system = convertPatientRaceSystem(
-            race=data.get_optional_patient_personal_info(field="race"),
+        patient_race, patient_race_desc, patient_race_system = resolve_demographic(
+            kind="race",
+            value=data.get_optional_patient_personal_info(field="race"),
             doh_json=doh_json,
-            master_file_race_table=master_file_obj.race_table,
-        )
-        segment = "patient_ethnicity"
-        patient_ethnicity = convertPatientEthnicity(
-            ethnicity=data.get_optional_patient_personal_info(field="ethnicity"),
-            doh_json=doh_json,
-            mater_file_ethnicity_table=master_file_obj.ethnicity_table,
-        )
-        segment = "patient_ethnicity_desc"
-        patient_ethnicity_desc = convertPatientEthnicityDesc(
-            ethnicity=data.get_optional_patient_personal_info(field="ethnicity"),
-            doh_json=doh_json,
-            mater_file_ethnicity_table=master_file_obj.ethnicity_table,
+            master_file_table=master_file_obj.race_table,
         )
 
-        segment = "patient_ethnicity_system"
-        patient_ethnicity_system = convertPatientEthnicitySystem(
-            ethnicity=data.get_optional_patient_personal_info(field="ethnicity"),
+        segment = "patient_ethnicity"
+        (
+            patient_ethnicity,
+            patient_ethnicity_desc,
+            patient_ethnicity_system,
+        ) = resolve_demographic(
+            kind="ethnicity",
+            value=data.get_optional_patient_personal_info(field="ethnicity"),
             doh_json=doh_json,
-            mater_file_ethnicity_table=master_file_obj.ethnicity_table,
+            master_file_table=master_file_obj.ethnicity_table,
         )
     except Exception as e:
         raise type(e)(f"Failed extracting variable - var: {segment}. Error:{e}")
@@ -730,25 +567,24 @@ def createSPMBlock(data: Hl7Record, doh_json: dict) -> Template:
         Template
     """
     try:
-        segment = "site_name"
-        site_name = specimen_site(
-            assay=data.test_kit_types["assay"], doh_test_list=doh_json["test_list"]
+        segment = "assay_profile"
+        assay_profile = resolve_assay_profile(
+            assay=data.test_kit_types["assay"],
+            doh_test_list=doh_json["test_list"],
+            table_name=f"{data.doh}.test_list",
         )
 
+        segment = "site_name"
+        site_name = assay_profile.site_name
+
         segment = "site_code"
-        site_code_var = site_code(
-            assay=data.test_kit_types["assay"], doh_test_list=doh_json["test_list"]
-        )
+        site_code_var = assay_profile.site_code
 
         segment = "spec_type"
-        spec_type = specimen_type(
-            assay=data.test_kit_types["assay"], doh_test_list=doh_json["test_list"]
-        )
+        spec_type = assay_profile.spec_type
 
         segment = "spec_source"
-        spec_source = specimen_source(
-            assay=data.test_kit_types["assay"], doh_test_list=doh_json["test_list"]
-        )
+        spec_source = assay_profile.spec_source
 
     except Exception as e:
         raise type(e)(f"Failed extracting variable - var: {segment}. Error:{e}")
@@ -769,6 +605,26 @@ def createSPMBlock(data: Hl7Record, doh_json: dict) -> Template:
 
 
 # ****************************************************************************
+SEGMENT_FUNCTIONS = {
+    "MSH": createMSHBlock,
+    "SFT": createSFTBlock,
+    "PID": createPIDBlock,
+    "ORC": createORCBlock,
+    "OBR": createOBRBlock,
+    "OBX": createOBXBlock,
+    "NTE": createNTEBlock,
+    "SPM": createSPMBlock,
+}
+
+# block function argument -> segments that require it
+SEGMENT_ARGS = {
+    "data": ("PID", "ORC", "OBR", "OBX", "SPM"),
+    "doh_json": ("MSH", "SFT", "PID", "ORC", "OBR", "OBX", "SPM"),
+    "master_file_obj": ("PID", "OBR", "OBX"),
+}
+NO_ARGS_SEGMENTS = ("NTE",)
+
+
 def hl7_message_blocks_switch(segment_type: str, *args, **kargs) -> Callable:
     """Function to emulate switch statment for the different block functions.
 
@@ -781,19 +637,8 @@ def hl7_message_blocks_switch(segment_type: str, *args, **kargs) -> Callable:
     Returns:
         Callable
     """
-    segment_functions = {
-        "MSH": createMSHBlock,
-        "SFT": createSFTBlock,
-        "PID": createPIDBlock,
-        "ORC": createORCBlock,
-        "OBR": createOBRBlock,
-        "OBX": createOBXBlock,
-        "NTE": createNTEBlock,
-        "SPM": createSPMBlock,
-    }
-
     try:
-        func = segment_functions[segment_type]
+        func = SEGMENT_FUNCTIONS[segment_type]
     except KeyError as e:
         raise KeyError("HL7 message block function not implemented.")
     else:
@@ -814,26 +659,31 @@ def section_requirements(
     Returns:
         dict
     """
-    no_args = ["NTE"]
-    data_args = ["PID", "ORC", "OBR", "OBX", "SPM"]
-    master_file_obj_args = ["PID", "OBR", "OBX"]
-    doh_json_args = ["MSH", "SFT", "PID", "ORC", "OBR", "OBX", "SPM"]
+    arguments = {"data": data, "doh_json": doh_json, "master_file_obj": master_file_obj}
 
-    kargs = {}
+    return {
+        name: arguments[name]
+        for name in segment_arg_names(segment, SEGMENT_ARGS, NO_ARGS_SEGMENTS)
+    }
 
-    if segment in no_args:
-        return kargs
 
-    if segment in data_args:
-        kargs["data"] = data
+@lru_cache(maxsize=None)
+def compile_message_plan(segment_list: tuple) -> tuple:
+    """Function to compile a DOH segment list into a plan of bound renderers, cached by
+    segment list so it's built once per DOH configuration.
 
-    if segment in doh_json_args:
-        kargs["doh_json"] = doh_json
+    Args:
+        segment_list (tuple)
 
-    if segment in master_file_obj_args:
-        kargs["master_file_obj"] = master_file_obj
+    Raises:
+        Exception: if a segment is not mapped, reporting the segment name.
 
-    return kargs
+    Returns:
+        tuple: (segment, renderer) pairs.
+    """
+    return build_message_plan(
+        segment_list, SEGMENT_FUNCTIONS, SEGMENT_ARGS, NO_ARGS_SEGMENTS
+    )
 
 
 def create_message(data: Hl7Record, doh_json: dict, master_file_obj) -> str:
@@ -850,20 +700,13 @@ def create_message(data: Hl7Record, doh_json: dict, master_file_obj) -> str:
     Returns:
         str
     """
-    required_segments = doh_json["segment_list"]
+    plan = compile_message_plan(tuple(doh_json["segment_list"]))
     segment_list = []
 
     try:
-        for seg in required_segments:
-
-            kargs = section_requirements(
-                segment=seg,
-                data=data,
-                doh_json=doh_json,
-                master_file_obj=master_file_obj,
-            )
+        for seg, renderer in plan:
 
-            segment = hl7_message_blocks_switch(segment_type=seg, **kargs)
+            segment = renderer(data, doh_json, master_file_obj)
 
             segment_list.append(segment)
 
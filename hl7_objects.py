@@ -1,12 +1,22 @@
-from json import load, dumps
+import re
+from os import stat
+from json import load, loads, dumps
 from abc import ABC
+from types import MappingProxyType
+from collections import ChainMap
 from uuid import uuid4
+from hashlib import sha256
+from threading import Lock
+from time import perf_counter
+from logging import INFO, DEBUG
 from datetime import datetime, timedelta
 from dateutil import parser
-from typing import Callable, Union
+from itertools import chain
+from typing import Callable, Mapping, NamedTuple, Tuple, Union
 from flatten_dict import flatten
 
 from us import STATES as USA_STATES
+from us import STATES_AND_TERRITORIES as USA_STATES_AND_TERRITORIES
 from us import states as us_states_object
 
 from dsl_utils.utils import path_join
@@ -15,6 +25,7 @@ from dsl_utils.utils import rm_characters
 
 
 from config import (
+    DEBUG_MODE,
     VALIDATION_MAPPERS,
     STATES_WITHOUT_UTC_ADJUSTMENT,
     PREPEND_NOMI_STATES,
@@ -27,8 +38,39 @@ from config import (
 )
 
 import state_level_validation_funcs
+from record_context import add_record_context_filter, append_record_keys
 
-from aws_lambda_powertools import logging
+from aws_lambda_powertools import Logger, logging
+
+LOGGER = Logger(service="hl7_objects", level=DEBUG if DEBUG_MODE else INFO)
+add_record_context_filter(LOGGER)
+
+# master files loaded in this container, by path
+_MASTER_FILES = {}
+_MASTER_FILES_LOCK = Lock()
+
+# DOH json files loaded in this container, by path
+_DOH_CONFIGS = {}
+_DOH_CONFIGS_LOCK = Lock()
+
+# us.states.lookup results for state names missing from STATE_NAME_ABBREVIATIONS
+_STATE_LOOKUPS = {}
+STATE_LOOKUPS_MAX_ENTRIES = 1024
+
+# reasons an order is skipped before its references are requested
+ORDER_SKIP_HL7_SENT = "hl7_sent"
+ORDER_SKIP_MESSAGE_NOT_REQUIRED = "message_not_required"
+ORDER_SKIP_REASONS = (ORDER_SKIP_HL7_SENT, ORDER_SKIP_MESSAGE_NOT_REQUIRED)
+
+# ISO-8601 timestamps as emitted by DocDB, parsed without dateutil
+ISO_DATETIME_PATTERN = re.compile(
+    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{3}|\.\d{6})?([+-]\d{2}:\d{2})?"
+)
+
+# results mapped in the master file result_table, any other result gets the default profile
+MAPPED_RESULT_VALUES = ("positive", "negative")
+# result names whose result_table entries are not split by procedure type
+RESULTS_WITHOUT_PROCEDURE = ("c19", "monkeypox")
 
 
 class MasterFileJson:
@@ -39,6 +81,21 @@ class RepeatedHl7MessageError(Exception):
     pass
 
 
+class ResultProfile(NamedTuple):
+    desc: str
+    snomed: str
+    abnormal_flag: str
+    abnormal_desc: str
+
+
+DEFAULT_RESULT_PROFILE = ResultProfile(
+    desc="Invalid result",
+    snomed="455371000124106",
+    abnormal_flag="N",
+    abnormal_desc="Normal",
+)
+
+
 def time_zone_state_adjustment(doh: str) -> str:
 
     if doh in STATES_LOCAL_TIME_ZONE_ADJUSTMENT_FROM_UTC:
@@ -68,8 +125,40 @@ def hl7StringRead(some_string: str) -> str:
     return some_string or "^"
 
 
+def normalize_state_name(state_name: str) -> str:
+    return state_name.lower()
+
+
+def build_state_abbreviations() -> dict:
+    """Function to map the normalized name, abbreviation and FIPS code of every entry
+    searched by us.states.lookup to its abbreviation. The first entry wins on collisions,
+    as in us.states.lookup.
+
+    Returns:
+        dict
+    """
+    state_abbreviations = {}
+
+    for state in chain(
+        USA_STATES_AND_TERRITORIES, [us_states_object.DC], us_states_object.OBSOLETE
+    ):
+        for key in (state.name, state.abbr, state.fips):
+            if key:
+                state_abbreviations.setdefault(normalize_state_name(key), state.abbr)
+
+    return state_abbreviations
+
+
+# abbreviations of every USA state, shared by all records
+STATE_ABBREVIATIONS = [state.abbr for state in USA_STATES]
+VALID_STATE_ABBREVIATIONS = frozenset(STATE_ABBREVIATIONS)
+STATE_NAME_ABBREVIATIONS = build_state_abbreviations()
+
+
 def findStateAbbreviation(state_name: str) -> str:
     """Function to get the state abbreviation from any representation of state names.
+    Exact names, abbreviations and FIPS codes are resolved from STATE_NAME_ABBREVIATIONS,
+    anything else goes through the us.states.lookup phonetic matching once.
 
     Args:
         state_name (str)
@@ -77,9 +166,179 @@ def findStateAbbreviation(state_name: str) -> str:
     Returns:
         str
     """
+    normalized_name = normalize_state_name(state_name)
+
+    try:
+        return STATE_NAME_ABBREVIATIONS[normalized_name]
+    except KeyError:
+        pass
+
+    try:
+        return _STATE_LOOKUPS[normalized_name]
+    except KeyError:
+        pass
+
     state = us_states_object.lookup(state_name)
+    abbreviation = state.abbr if state else ""
+
+    if len(_STATE_LOOKUPS) >= STATE_LOOKUPS_MAX_ENTRIES:
+        _STATE_LOOKUPS.clear()
+    _STATE_LOOKUPS[normalized_name] = abbreviation
+
+    return abbreviation
+
+
+def build_doh_index(doh_mappings: list) -> dict:
+    """Function to invert the master file doh_mappings into org_id -> cleaned DOH names,
+    keeping the doh_mappings order. Org ids listed twice for the same DOH are dropped
+    and reported, as are org ids mapped to more than one DOH.
+
+    Args:
+        doh_mappings (list)
+
+    Returns:
+        dict
+    """
+    doh_index = {}
+    duplicates = []
+
+    for mapping in doh_mappings:
+        doh = clean_str(mapping["doh"])
+
+        for org_id in mapping["orgList"]:
+            dohs = doh_index.setdefault(org_id, [])
+
+            if doh in dohs:
+                duplicates.append(f"{org_id}: {doh}")
+                continue
+
+            dohs.append(doh)
+
+    conflicts = {org_id: dohs for org_id, dohs in doh_index.items() if len(dohs) > 1}
+
+    if duplicates:
+        LOGGER.warning(f"Duplicated org ids in doh_mappings: {dumps(duplicates)}")
+
+    if conflicts:
+        LOGGER.warning(f"Org ids mapped to more than one DOH: {dumps(conflicts)}")
+
+    return doh_index
+
+
+def build_result_profile(
+    result_table: dict, result_value: str, result_name: str, procedure_type_id: str
+) -> ResultProfile:
+    """Function to build the ResultProfile of one master file result_table entry.
+    Result names listed in RESULTS_WITHOUT_PROCEDURE are looked up without a
+    procedure_type_id.
+
+    Args:
+        result_table (dict)
+        result_value (str)
+        result_name (str)
+        procedure_type_id (str): None for RESULTS_WITHOUT_PROCEDURE.
+
+    Raises:
+        KeyError: If the entry is missing or incomplete.
+
+    Returns:
+        ResultProfile
+    """
+    try:
+        profile = result_table[result_value][result_name]
+
+        if procedure_type_id is not None:
+            profile = profile[procedure_type_id]
+
+        return ResultProfile(
+            desc=profile["desc"],
+            snomed=profile["snomed"],
+            abnormal_flag=profile["abnormal_flag"],
+            abnormal_desc=profile["abnormal_desc"],
+        )
+    except (KeyError, TypeError) as e:
+        raise KeyError(
+            f"Result not mapped in master file result_table: {result_value}, {result_name}, {procedure_type_id}, missing: {e}"
+        )
+
+
+def message_delivered(order: dict) -> bool:
+    """Function to test if the HL7 message of an order has been delivered already.
+
+    Args:
+        order (dict)
+
+    Returns:
+        bool
+    """
+    return order["states"].get("HL7_SENT") is not None
+
+
+def is_message_required(order: dict) -> bool:
+    """Function to test if the order results meet the conditions to create HL7 message.
+
+    Args:
+        order (dict)
+
+    Returns:
+        bool
+    """
+    test_logic = [
+        any(
+            clean_str(result["result"]) not in ["positive", "negative"]
+            for result in order["results"]
+        ),
+        any(result == "" for result in order["results"]),
+        any(result is None for result in order["results"]),
+    ]
+
+    return not any(test_logic)
+
+
+def order_skip_reason(order: dict) -> Union[str, None]:
+    """Function to check an order_search result before any of its references are
+    requested. Returns the ORDER_SKIP_REASONS entry of an order that does not need an
+    HL7 message, None otherwise. Orders that cannot be checked are not skipped, so
+    their errors are reported when the message is built.
+
+    Args:
+        order (dict)
+
+    Returns:
+        Union[str, None]
+    """
+    try:
+        if message_delivered(order) and not PROCESS_REPEATED_MESSAGES:
+            return ORDER_SKIP_HL7_SENT
+
+        if not is_message_required(order):
+            return ORDER_SKIP_MESSAGE_NOT_REQUIRED
+
+    except (AttributeError, KeyError, TypeError):
+        pass
+
+    return None
+
+
+def parse_iso_string(date_time: str) -> datetime:
+    """Function to parse an ISO-8601 string. The fixed formats emitted by DocDB are parsed
+    with datetime.fromisoformat, any other string with dateutil.
+
+    Args:
+        date_time (str)
+
+    Returns:
+        datetime
+    """
+    if date_time.endswith("Z"):
+        fast_path_input = date_time[:-1] + "+00:00"
+    else:
+        fast_path_input = date_time
+
+    if ISO_DATETIME_PATTERN.fullmatch(fast_path_input):
+        return datetime.fromisoformat(fast_path_input)
 
-    return state.abbr if state else ""
+    return parser.isoparse(date_time)
 
 
 def parse_datetime_isoformat(state: str, date_time: Union[str, datetime]) -> datetime:
@@ -95,7 +354,7 @@ def parse_datetime_isoformat(state: str, date_time: Union[str, datetime]) -> dat
     if isinstance(date_time, datetime):
         date_time_object = date_time
     else:
-        date_time_object = parser.isoparse(date_time)
+        date_time_object = parse_iso_string(date_time)
 
     return (
         date_time_object
@@ -105,24 +364,133 @@ def parse_datetime_isoformat(state: str, date_time: Union[str, datetime]) -> dat
     )
 
 
+# placeholder for paths that are missing or do not lead to a leaf value
+MISSING_VALUE = object()
+
+
+def get_payload_value(payload: dict, path: tuple):
+    """Function to read a nested path of a payload. Paths that are missing or lead to a
+    dict return MISSING_VALUE, as they have no key in the flattened payload.
+
+    Args:
+        payload (dict)
+        path (tuple)
+
+    Returns:
+        Any
+    """
+    value = payload
+
+    for key in path:
+        if not isinstance(value, dict):
+            return MISSING_VALUE
+
+        value = value.get(key, MISSING_VALUE)
+
+        if value is MISSING_VALUE:
+            return MISSING_VALUE
+
+    return MISSING_VALUE if isinstance(value, dict) else value
+
+
+class PayloadValidator:
+    """Class to check the optional and required paths of a message payload. The config
+    lists are compiled once and only the listed paths are read from the payload.
+
+    Args:
+        optional_args (list): paths that should be in the payload.
+        required_args (list): paths that must be in the payload.
+        required_args_in_lists (list): {path: key} that must be in every dict of a list.
+    """
+
+    def __init__(
+        self, optional_args: list, required_args: list, required_args_in_lists: list
+    ):
+        self.optional_paths = tuple(tuple(path) for path in optional_args)
+        self.required_paths = tuple(tuple(path) for path in required_args)
+        self.required_list_paths = tuple(
+            (tuple(path), item_key)
+            for paths in required_args_in_lists
+            for path, item_key in paths.items()
+        )
+
+    def validate(self, payload: dict) -> Tuple[list, list]:
+        """Method to return every missing optional and required path in one pass.
+        Lists that are missing, or with items missing the key, are reported as the list
+        path plus that key.
+
+        Args:
+            payload (dict)
+
+        Returns:
+            Tuple[list, list]: missing optional paths, missing required paths.
+        """
+        missing_optional = [
+            path
+            for path in self.optional_paths
+            if get_payload_value(payload, path) is MISSING_VALUE
+        ]
+        missing_required = [
+            path
+            for path in self.required_paths
+            if get_payload_value(payload, path) is MISSING_VALUE
+        ]
+
+        for path, item_key in self.required_list_paths:
+            items = get_payload_value(payload, path)
+
+            if not isinstance(items, list) or not all(
+                isinstance(item, dict) and item_key in item for item in items
+            ):
+                missing_required.append(path + (item_key,))
+
+        return missing_optional, missing_required
+
+
+HL7_PAYLOAD_VALIDATOR = PayloadValidator(
+    optional_args=HL7_OPTIONAL_ARGS,
+    required_args=HL7_REQUIRED_ARGS,
+    required_args_in_lists=HL7_REQUIRED_ARGS_IN_LISTS,
+)
+
+
 class SharedMethods(ABC):
-    """Abstract class to be use as database engine template."""
+    """Abstract class to be use as database engine template.
+
+    Subclasses declare their data fields in _fields and their internal state in
+    __slots__, both read as plain attributes. Keyword arguments that are not declared
+    are kept in _extra and served by __getattr__. Instances are immutable, internal
+    state is written with _set.
+    """
+
+    __slots__ = ("args", "STATES", "doh", "_extra")
+    _fields = ()
 
     def __init__(self, *args, **kwargs) -> None:
         """Constructor for Immutable database engine class."""
 
-        private_components = {f"_{k}": v for k, v in kwargs.items()}
-        self.__dict__.update(private_components)
-        self.__dict__["_args"] = args
-        self.__dict__["_STATES"] = [state.abbr for state in USA_STATES]
-        self.__dict__["_doh"] = None
+        extra = {}
+        for name, value in kwargs.items():
+            if name in self._fields:
+                self._set(name, value)
+            else:
+                extra[name] = value
+
+        self._set("_extra", extra)
+        self._set("args", args)
+        self._set("STATES", STATE_ABBREVIATIONS)
+        self._set("doh", None)
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
 
     def __getattr__(self, name):
-        private_name = f"_{name}"
         try:
-            return self.__dict__[private_name]
-        except KeyError:
-            raise AttributeError(f"{self!r} object has no attribute {name!r}")
+            return object.__getattribute__(self, "_extra")[name]
+        except (AttributeError, KeyError):
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}"
+            )
 
     def __setattr__(self, name, value):
         raise AttributeError(f"Cant set attribute {name!r}")
@@ -130,35 +498,48 @@ class SharedMethods(ABC):
     def __delattr__(self, name):
         raise AttributeError(f"Cannot delete attribute {name!r}")
 
+    def _items(self):
+        """Method to yield the (name, value) of every set attribute, slots first."""
+        for cls in reversed(type(self).__mro__):
+            for name in cls.__dict__.get("__slots__", ()):
+                if name == "_extra":
+                    continue
+                try:
+                    yield name, object.__getattribute__(self, name)
+                except AttributeError:
+                    continue
+
+        yield from object.__getattribute__(self, "_extra").items()
+
     def __repr__(self):
 
         return "{}({})".format(
             type(self).__name__,
             ", ".join(
                 "{k}={v}".format(
-                    k=k[1:],
+                    k=k,
                     v=v,
                 )
-                for k, v in self.__dict__.items()
+                for k, v in self._items()
             ),
         )
 
     def _return_args(self):
 
-        return self.__dict__["_args"]
+        return self.args
 
     def _return_kargs(self):
 
-        return {f"{k[1:]}": v for k, v in self.__dict__.items() if k not in ["_args"]}
+        return {k: v for k, v in self._items() if k not in ["args"]}
 
-    def class_private_vars(self) -> dict:
-        """Method to return a dictionary with all the args and kwargs.
-            Method allows the modification of the attribute values.
+    def class_private_vars(self) -> Mapping:
+        """Method to return a read only dictionary with all the args and kwargs, keyed
+            by their private names. Attribute values are modified with _set.
 
         Returns:
-            dict
+            Mapping
         """
-        return vars(self)
+        return MappingProxyType({f"_{k}": v for k, v in self._items()})
 
     def return_class_data_as_dict(self) -> dict:
         """Method to return the payload as a dictionary. Values are immutable.
@@ -167,17 +548,22 @@ class SharedMethods(ABC):
             dict
         """
         return {
-            f"{key[1:]}": value
-            for key, value in self.__dict__.items()
+            key: value
+            for key, value in self._items()
             if key
             not in [
-                "_args",
-                "_MRN",
-                "_STATES",
-                "_LOGGER",
-                "_MasterFileJson",
-                "_doh",
-                "_dohs",
+                "args",
+                "MRN",
+                "STATES",
+                "LOGGER",
+                "MasterFileJson",
+                "doh",
+                "dohs",
+                "doh_index",
+                "result_profiles",
+                "flat_views",
+                "patient_state_abbreviation",
+                "hl7_timestamps",
             ]
         }
 
@@ -198,72 +584,60 @@ class SharedMethods(ABC):
 
 
 class Hl7Record(SharedMethods):
+    _fields = (
+        "order",
+        "procedure",
+        "test_kit_types",
+        "facility",
+        "encounter",
+        "patient",
+    )
+    __slots__ = _fields + (
+        "perform_facility_override",
+        "LOGGER",
+        "MasterFileJson",
+        "flat_views",
+        "dohs",
+        "MRN",
+        "patient_state_abbreviation",
+        "hl7_timestamps",
+    )
+
     def __init__(self, record: dict, logger: logging, MasterFileJson):
 
-        flat_dict = flatten(record)
         super().__init__(**record)
 
-        self.class_private_vars()["_perform_facility_override"] = False
-        self.class_private_vars()["_LOGGER"] = logger
-        self.class_private_vars()["_MasterFileJson"] = MasterFileJson
-
-        missing_attrs_required = []
-        missing_attrs_optional = []
-
-        # optional_params -------
-
-        for key in HL7_OPTIONAL_ARGS:
-            try:
-                flat_dict[key]
-            except KeyError:
-                missing_attrs_optional.append(key)
-
-        # required_params ------
-
-        for key in HL7_REQUIRED_ARGS:
-            try:
-                flat_dict[key]
-
-                if ("order", "states", "RESULTED") == key:
-                    self._logger_handler(
-                        logger=self.LOGGER,
-                        result_date=self.order["states"]["RESULTED"],
-                    )
-                if ("test_kit_types", "assay") == key: #TODO do we need vaccine_kit_types as well?
-                    self._logger_handler(
-                        logger=self.LOGGER, assay=self.test_kit_types["assay"]
-                    )
+        self._set("perform_facility_override", False)
+        self._set("LOGGER", logger)
+        self._set("MasterFileJson", MasterFileJson)
+        self._set("flat_views", {})
+        self._set("hl7_timestamps", {})
 
-                if ("facility", "org_id") == key:
-                    self._logger_handler(
-                        logger=self.LOGGER, org_id=self.facility["org_id"]
-                    )
-
-                    if self.LOGGER is not None:
-                        self.LOGGER.info("Determining DOH.")
-
-                    dohs = self.MasterFileJson.find_dohs(
-                        facility_org_id=self.facility["org_id"]
-                    )
-                    self.class_private_vars()["_dohs"] = dohs
-                    self._logger_handler(
-                        logger=self.LOGGER, doh=[doh.title() for doh in dohs]
-                    )
+        missing_attrs_optional, missing_attrs_required = HL7_PAYLOAD_VALIDATOR.validate(
+            record
+        )
+        required_attrs = set(HL7_PAYLOAD_VALIDATOR.required_paths).difference(
+            missing_attrs_required
+        )
 
-            except KeyError:
-                missing_attrs_required.append(key)
+        if ("order", "states", "RESULTED") in required_attrs:
+            self._logger_handler(
+                logger=self.LOGGER, result_date=self.order["states"]["RESULTED"]
+            )
 
-        for dict in HL7_REQUIRED_ARGS_IN_LISTS:
+        if ("test_kit_types", "assay") in required_attrs:
+            # TODO do we need vaccine_kit_types as well?
+            self._logger_handler(logger=self.LOGGER, assay=self.test_kit_types["assay"])
 
-            try:
-                for key, value_to_check in dict.items():
+        if ("facility", "org_id") in required_attrs:
+            self._logger_handler(logger=self.LOGGER, org_id=self.facility["org_id"])
 
-                    nested_list = flat_dict[key]
+            if self.LOGGER is not None:
+                self.LOGGER.info("Determining DOH.")
 
-                    for item in nested_list:
-                        assert value_to_check in item
-            except AssertionError:
-                missing_attrs_required.append((key, value_to_check))
+            dohs = self.MasterFileJson.find_dohs(facility_org_id=self.facility["org_id"])
+            self._set("dohs", dohs)
+            self._logger_handler(logger=self.LOGGER, doh=[doh.title() for doh in dohs])
 
         if missing_attrs_optional:
             logger.warning(
@@ -274,8 +648,8 @@ class Hl7Record(SharedMethods):
             len(missing_attrs_required) == 0
         ), f"Object is missing the following required attributes: {dumps(['.'.join(i) for i in missing_attrs_required])}"
 
-        self.class_private_vars()["_MRN"] = (
-            self.order["patient_id"][:5] + "-" + self.order["patient_id"][5:]
+        self._set(
+            "MRN", self.order["patient_id"][:5] + "-" + self.order["patient_id"][5:]
         )
         self._logger_handler(logger=self.LOGGER, mrn=self.MRN)
 
@@ -285,28 +659,51 @@ class Hl7Record(SharedMethods):
                 raise RepeatedHl7MessageError("Message has been delivered already.")
 
     def _message_delivered(self) -> bool:
-        if "HL7_SENT" in self.order["states"]:
-            return self.order["states"]["HL7_SENT"] is not None
-        else:
-            return False
+        return message_delivered(self.order)
 
     @staticmethod
     def _logger_handler(logger, **kargs):
-        logger.append_keys(**kargs) if logger is not None else 1
+        # record keys are kept per thread, Logger.append_keys is shared by every record
+        append_record_keys(**kargs) if logger is not None else 1
+
+    def _patient_state_abbreviation(self) -> str:
+        try:
+            return self.patient_state_abbreviation
+        except AttributeError:
+            abbreviation = findStateAbbreviation(
+                self.get_patient_data("address", "state")
+            )
+            self._set("patient_state_abbreviation", abbreviation)
+
+            return abbreviation
 
     def _is_state_valid(self) -> bool:
-        return (
-            findStateAbbreviation(self.get_patient_data("address", "state"))
-            in self.STATES
-        )
+        return self._patient_state_abbreviation() in VALID_STATE_ABBREVIATIONS
 
     def _return_data_if_state_valid(self, input: str) -> str:
         return input if self._is_state_valid() else ""
 
-    @staticmethod
-    def _parse_flat_dict(collection, *args):
+    def _flat_view(self, collection_name: str) -> dict:
+        """Method to return a record collection flattened into tuple keys. Each collection
+        is flattened once per record, the record data must not be modified afterwards.
+
+        Args:
+            collection_name (str)
+
+        Returns:
+            dict
+        """
         try:
-            return flatten(collection)[args]
+            return self.flat_views[collection_name]
+        except KeyError:
+            flat_view = flatten(getattr(self, collection_name))
+            self.flat_views[collection_name] = flat_view
+
+            return flat_view
+
+    def _parse_flat_dict(self, collection_name: str, *args):
+        try:
+            return self._flat_view(collection_name)[args]
         except KeyError:
             return "^"
 
@@ -341,19 +738,10 @@ class Hl7Record(SharedMethods):
         Returns:
             bool
         """
-        test_logic = [
-            any(
-                clean_str(result["result"]) not in ["positive", "negative"]
-                for result in self.order["results"]
-            ),
-            any(result == "" for result in self.order["results"]),
-            any(result is None for result in self.order["results"]),
-        ]
-
-        return not any(test_logic)
+        return is_message_required(self.order)
 
     def add_doh(self, input: str) -> None:
-        self.class_private_vars()["_doh"] = clean_str(input)
+        self._set("doh", clean_str(input))
 
     def facility_name(self):
         return prepend_nomi_to_facility_name(doh=self.doh) + self.facility["name"]
@@ -367,14 +755,34 @@ class Hl7Record(SharedMethods):
 
         return ""
 
+    def _hl7_timestamp(self, name: str, input: str) -> str:
+        """Method to render an order timestamp for the current DOH once per record.
+
+        Args:
+            name (str): timestamp name, used as cache key with the DOH.
+            input (str)
+
+        Returns:
+            str
+        """
+        key = (self.doh, name)
+
+        try:
+            return self.hl7_timestamps[key]
+        except KeyError:
+            timestamp = self.parse_iso_datetime_to_hl7_format(
+                state=self.doh, input=input
+            )
+            self.hl7_timestamps[key] = timestamp
+
+            return timestamp
+
     def str_collection_date_time(self) -> str:
-        return self.parse_iso_datetime_to_hl7_format(
-            state=self.doh, input=self.order["sample_date"]
-        )
+        return self._hl7_timestamp(name="sample_date", input=self.order["sample_date"])
 
     def str_results_date_time(self) -> str:
-        return self.parse_iso_datetime_to_hl7_format(
-            state=self.doh, input=self.order["states"]["RESULTED"]
+        return self._hl7_timestamp(
+            name="resulted", input=self.order["states"]["RESULTED"]
         )
 
     def str_patient_dob(self):
@@ -410,10 +818,8 @@ class Hl7Record(SharedMethods):
         return self.patient["personal"].get(field, "")
 
     def patient_state(self) -> str:
-        return findStateAbbreviation(
-            self._return_data_if_state_valid(
-                input=self.get_patient_data("address", "state")
-            )
+        return self._return_data_if_state_valid(
+            input=self._patient_state_abbreviation()
         )
 
     def patient_postal_code(self) -> str:
@@ -422,19 +828,19 @@ class Hl7Record(SharedMethods):
         )
 
     def get_test_kit_id(self) -> str:
-        return self._parse_flat_dict(self.order, "test_kit_id")
+        return self._parse_flat_dict("order", "test_kit_id")
 
     def get_vaccine_kit_id(self) -> str:
-        return self._parse_flat_dict(self.order, "vaccine_kit_type_id")
+        return self._parse_flat_dict("order", "vaccine_kit_type_id")
 
     def get_mrn(self) -> str:
         return self.MRN
 
     def get_facility_data(self, *args) -> str:
-        return self._parse_flat_dict(self.facility, *args)
+        return self._parse_flat_dict("facility", *args)
 
     def get_patient_data(self, *args) -> str:
-        return self._parse_flat_dict(self.patient, *args)
+        return self._parse_flat_dict("patient", *args)
 
     def get_patient_id(self) -> str:
         return self.encounter["patient_id"]
@@ -498,7 +904,7 @@ class Hl7Record(SharedMethods):
         return "USA"
 
     def performing_facility_override(self, value: bool):
-        self.class_private_vars()["_perform_facility_override"] = value
+        self._set("perform_facility_override", value)
         
     def facility_clia_number(self):
         if self.order["procedure_type_id"] in ["PCR"]:
@@ -572,14 +978,22 @@ class MasterFileJson(SharedMethods):
         SharedMethods
     """
 
-    def __init__(self, master_json_dir_path: str = "json"):
+    _fields = ("doh_mappings", "result_table", "race_table", "ethnicity_table")
+    __slots__ = _fields + ("doh_index", "result_profiles")
 
-        with open(
-            path_join(master_json_dir_path, "master_file.json")
-        ) as file:  # change this to handle text and streaming
-            json_data = load(file)
+    def __init__(self, master_json_dir_path: str = "json", json_data: dict = None):
 
-            super().__init__(**json_data)
+        if json_data is None:
+            with open(
+                path_join(master_json_dir_path, "master_file.json")
+            ) as file:  # change this to handle text and streaming
+                json_data = load(file)
+
+        super().__init__(**json_data)
+
+        self._set("doh_index", build_doh_index(json_data.get("doh_mappings", [])))
+        # ResultProfiles built on first lookup, an incomplete entry only fails its results
+        self._set("result_profiles", {})
 
     def find_dohs(self, facility_org_id: str) -> list:
         """Method to find the DOHs mapped to the specific message facility_clia.
@@ -590,14 +1004,116 @@ class MasterFileJson(SharedMethods):
         Returns:
             list
         """
-        doh_list = list(
-            map(
-                lambda x: clean_str(x["doh"]),
-                filter(lambda x: facility_org_id in x["orgList"], self.doh_mappings),
-            )
+        return list(self.doh_index.get(facility_org_id, ()))
+
+    def find_result_profile(
+        self, result_value: str, result_name: str, procedure_type_ids: list
+    ) -> ResultProfile:
+        """Method to find the description, snomed and abnormal flag/description of a result.
+        Results that are not positive or negative get the DEFAULT_RESULT_PROFILE.
+
+        Args:
+            result_value (str)
+            result_name (str)
+            procedure_type_ids (list)
+
+        Raises:
+            KeyError: If a positive or negative result is not in the result_table, or
+            its entry is incomplete.
+
+        Returns:
+            ResultProfile
+        """
+        result_value = clean_str(result_value)
+
+        if result_value not in MAPPED_RESULT_VALUES:
+            return DEFAULT_RESULT_PROFILE
+
+        result_name = clean_str(result_name)
+        procedure_type_id = (
+            None
+            if result_name in RESULTS_WITHOUT_PROCEDURE
+            else clean_str(procedure_type_ids[0])
+        )
+
+        key = (result_value, result_name, procedure_type_id)
+
+        try:
+            return self.result_profiles[key]
+        except KeyError:
+            pass
+
+        result_profile = build_result_profile(self.result_table, *key)
+        self.result_profiles[key] = result_profile
+
+        return result_profile
+
+
+def load_master_file(master_json_dir_path: str = "json") -> MasterFileJson:
+    """Function to return the MasterFileJson shared by every record and warm invocation.
+    The file is parsed again only when its mtime changes and its content hash differs.
+
+    Args:
+        master_json_dir_path (str, optional). Defaults to "json".
+
+    Returns:
+        MasterFileJson
+    """
+    path = path_join(master_json_dir_path, "master_file.json")
+    mtime = stat(path).st_mtime_ns
+
+    cached = _MASTER_FILES.get(path)
+    if cached is not None and cached["mtime"] == mtime:
+        return cached["instance"]
+
+    with _MASTER_FILES_LOCK:
+        cached = _MASTER_FILES.get(path)
+        if cached is not None and cached["mtime"] == mtime:
+            return cached["instance"]
+
+        start = perf_counter()
+        with open(path, "rb") as file:
+            content = file.read()
+        digest = sha256(content).hexdigest()
+
+        if cached is not None and cached["digest"] == digest:
+            cached["mtime"] = mtime
+            return cached["instance"]
+
+        instance = MasterFileJson(json_data=loads(content))
+        _MASTER_FILES[path] = {"instance": instance, "mtime": mtime, "digest": digest}
+
+        LOGGER.info(
+            f"Master file {'reloaded' if cached else 'loaded (cold start)'} in {perf_counter() - start:.4f}s."
         )
 
-        return doh_list
+        return instance
+
+
+def load_doh_config(doh: str, json_dir_path: str = "json") -> Mapping:
+    """Function to return the parsed json/<State>.json file, read once per container.
+    The mapping is read only and shared by every message, nested values must not be modified.
+
+    Args:
+        doh (str)
+        json_dir_path (str, optional). Defaults to "json".
+
+    Returns:
+        Mapping
+    """
+    path = path_join(json_dir_path, f"{doh.title()}.json")
+
+    try:
+        return _DOH_CONFIGS[path]
+    except KeyError:
+        pass
+
+    with _DOH_CONFIGS_LOCK:
+        if path not in _DOH_CONFIGS:
+            with open(path) as file:
+                _DOH_CONFIGS[path] = MappingProxyType(load(file))
+
+        return _DOH_CONFIGS[path]
 
 
 class StateDoh:
@@ -611,6 +1127,9 @@ class StateDoh:
         Constructor extracts important information from the dictionaries and the
         information is stored in doh_logic, file_locations and file_formats attributes.
 
+        Each doh_data entry is a per message view: the message metadata is overlaid on
+        the shared DOH configuration, which is neither copied nor modified.
+
         Args:
             dohs (list)
         """
@@ -623,15 +1142,14 @@ class StateDoh:
 
         for doh in dohs:
 
-            with open(path_join("json", f"{doh.title()}.json")) as file:
-                self.doh_data[doh] = load(file)
-                self.doh_data[doh]["metadata"] = {
-                    "message_control_id": uuid4().int,
-                    "message_timestamp": SharedMethods.parse_iso_datetime_to_hl7_format(
-                        state=doh, input=datetime.utcnow()
-                    ),
-                }
-
-                doh_logic = self.doh_data[doh]["logic"]
-                self.file_locations[doh] = doh_logic["file_location"]
-                self.file_formats[doh] = doh_logic["file_format"]
+            metadata = {
+                "message_control_id": uuid4().int,
+                "message_timestamp": SharedMethods.parse_iso_datetime_to_hl7_format(
+                    state=doh, input=datetime.utcnow()
+                ),
+            }
+            self.doh_data[doh] = ChainMap({"metadata": metadata}, load_doh_config(doh))
+
+            doh_logic = self.doh_data[doh]["logic"]
+            self.file_locations[doh] = doh_logic["file_location"]
+            self.file_formats[doh] = doh_logic["file_format"]
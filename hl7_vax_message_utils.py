@@ -1,17 +1,25 @@
 from pathlib import Path
+from functools import lru_cache
 from string import Template
 from typing import Callable
 from datetime import datetime
 from aws_lambda_powertools import Logger
-from dsl_utils.utils import path_join
-from dsl_utils.utils import clean_str
+from record_context import add_record_context_filter
+from hl7_message_common import (
+    build_message_plan,
+    load_file_template,
+    load_template_registry,
+    patient_table_mapper,
+    resolve_demographic,
+    segment_arg_names,
+)
 
 
 class Hl7Record:
     pass
 
 
-TEMPLATE_BASE = Path("vax_templates")
+TEMPLATE_BASE = Path(__file__).parent / "vax_templates"
 MSH_TEMPLATE = "msh.txt"
 OBX_TEMPLATE = "obx.txt"
 ORC_TEMPLATE = "orc.txt"
@@ -19,8 +27,18 @@ PD1_TEMPLATE = "pd1.txt"
 PID_TEMPLATE = "pid.txt"
 RXA_TEMPLATE = "rxa.txt"
 RXR_TEMPLATE = "rxr.txt"
+# loaded at import, templates not listed here are loaded on first use
+TEMPLATE_NAMES = (
+    MSH_TEMPLATE,
+    OBX_TEMPLATE,
+    ORC_TEMPLATE,
+    PID_TEMPLATE,
+    RXA_TEMPLATE,
+    RXR_TEMPLATE,
+)
 
 logger = Logger(service="hl7_vax_message_utils")
+add_record_context_filter(logger)
 
 
 def apply_ssn_logic(ssn: str, doh_json: dict) -> str:
@@ -49,8 +67,7 @@ def loadFileTemplate(fileName: str) -> str:
     Returns:
         str
     """
-    with open(path_join(TEMPLATE_BASE, fileName), "r") as file:
-        return file.read()
+    return load_file_template(TEMPLATE_BASE, fileName)
 
 
 def imprintTemplate(template_name: str, value_dict: dict) -> Template:
@@ -63,105 +80,62 @@ def imprintTemplate(template_name: str, value_dict: dict) -> Template:
     Returns:
         Template
     """
-    sectionTemplate = loadFileTemplate(template_name)
-    hl7Section = Template(sectionTemplate).substitute(value_dict)
+    template = TEMPLATES.get(template_name)
 
-    return hl7Section
+    if template is None:
+        template = load_template_registry(TEMPLATE_BASE, (template_name,))[template_name]
+        TEMPLATES[template_name] = template
 
+    return template.substitute(value_dict)
 
-def patient_table_mapper(
-    value_to_check: str,
-    table_to_iterate: list,
-    return_key: str,
-    comparison_operator: str,
-    default_value: str = None,
-    raise_error: Exception = None,
-    json_key: str = "databus_name",
-) -> str:
-    """Function to map different tables to the argument value_to_check.
-
-    Args:
-        value_to_check (str)
-        table_to_iterate (list)
-        return_key (str)
-        comparison_operator (str)
-        default_value (str, optional). Defaults to None.
-        raise_error (Exception, optional). Defaults to None.
-        json_key (str, optional). Defines the key to use to filter the differnt json files. Defaults to "databus_name".
 
-    Raises:
-        raise_error: If no condition is met, an optional error can be raised.
-        ValueError: If no condition is met and no default values or errors are given.
-
-    Returns:
-        str
-    """
-    for test in table_to_iterate:
-
-        if clean_str(comparison_operator) == "in":
-            if clean_str(value_to_check).replace(" ", "") in [
-                clean_str(_).replace(" ", "") for _ in test[json_key]
-            ]:
-                return test[return_key]
-
-        if clean_str(comparison_operator) == "==":
-            if clean_str(value_to_check).replace(" ", "") == clean_str(
-                test[json_key]
-            ).replace(" ", ""):
-                return test[return_key]
-
-    if raise_error is not None:
-        raise raise_error
-    elif default_value is not None:
-        return default_value
-    else:
-        raise ValueError("Not raise error or default value specified.")
+TEMPLATES = load_template_registry(TEMPLATE_BASE, TEMPLATE_NAMES)
 
 
 def convertPatientEthnicity(
     ethnicity: str, doh_json: dict, mater_file_ethnicity_table: list
 ) -> str:
-    return patient_table_mapper(
-        value_to_check=ethnicity.lower(),
-        table_to_iterate=mater_file_ethnicity_table,
-        return_key="value",
-        default_value=doh_json["specific_values"]["default_ethnicity_code"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="ethnicity",
+        value=ethnicity,
+        doh_json=doh_json,
+        master_file_table=mater_file_ethnicity_table,
+        fields=("code",),
+    )[0]
 
 
 def convertPatientEthnicityDesc(
     ethnicity: str, doh_json: dict, mater_file_ethnicity_table: list
 ) -> str:
-    return patient_table_mapper(
-        value_to_check=ethnicity.lower(),
-        table_to_iterate=mater_file_ethnicity_table,
-        return_key="desc",
-        default_value=doh_json["specific_values"]["default_ethnicity_desc"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="ethnicity",
+        value=ethnicity,
+        doh_json=doh_json,
+        master_file_table=mater_file_ethnicity_table,
+        fields=("desc",),
+    )[0]
 
 
 def convertPatientRace(race: str, doh_json: dict, master_file_race_table: list) -> str:
-    return patient_table_mapper(
-        value_to_check=race.lower(),
-        table_to_iterate=master_file_race_table,
-        return_key="value",
-        default_value=doh_json["specific_values"]["default_race_code"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="race",
+        value=race,
+        doh_json=doh_json,
+        master_file_table=master_file_race_table,
+        fields=("code",),
+    )[0]
 
 
 def convertPatientRaceDesc(
     race: str, doh_json: dict, master_file_race_table: list
 ) -> str:
-    return patient_table_mapper(
-        value_to_check=race.lower(),
-        table_to_iterate=master_file_race_table,
-        return_key="desc",
-        default_value=doh_json["specific_values"]["default_race_desc"],
-        comparison_operator="in",
-    )
+    return resolve_demographic(
+        kind="race",
+        value=race,
+        doh_json=doh_json,
+        master_file_table=master_file_race_table,
+        fields=("desc",),
+    )[0]
 
 
 #TODO: Done, but will need the actual org_ids from Jovi
@@ -238,28 +212,21 @@ def createPIDBlock(data: Hl7Record, doh_json: dict, master_file_obj) -> Template
 
     try:
         segment = "patient_race"
-        patient_race = convertPatientRace(
-            race=data.get_optional_patient_personal_info(field="race"),
-            doh_json=doh_json,
-            master_file_race_table=master_file_obj.race_table,
-        )
-        segment = "patient_race_desc"
-        patient_race_desc = convertPatientRaceDesc(
-            race=data.get_optional_patient_personal_info(field="race"),
+        patient_race, patient_race_desc = resolve_demographic(
+            kind="race",
+            value=data.get_optional_patient_personal_info(field="race"),
             doh_json=doh_json,
-            master_file_race_table=master_file_obj.race_table,
+            master_file_table=master_file_obj.race_table,
+            fields=("code", "desc"),
         )
+
         segment = "patient_ethnicity"
-        patient_ethnicity = convertPatientEthnicity(
-            ethnicity=data.get_optional_patient_personal_info(field="ethnicity"),
-            doh_json=doh_json,
-            mater_file_ethnicity_table=master_file_obj.ethnicity_table,
-        )
-        segment = "patient_ethnicity_desc"
-        patient_ethnicity_desc = convertPatientEthnicityDesc(
-            ethnicity=data.get_optional_patient_personal_info(field="ethnicity"),
+        patient_ethnicity, patient_ethnicity_desc = resolve_demographic(
+            kind="ethnicity",
+            value=data.get_optional_patient_personal_info(field="ethnicity"),
             doh_json=doh_json,
-            mater_file_ethnicity_table=master_file_obj.ethnicity_table,
+            master_file_table=master_file_obj.ethnicity_table,
+            fields=("code", "desc"),
         )
     except Exception as e:
         raise type(e)(f"Failed extracting variable - var: {segment}. Error:{e}")
@@ -346,6 +313,25 @@ def createRXRBlock(data: Hl7Record, doh_json: dict) -> Template:
 
 
 # ****************************************************************************
+SEGMENT_FUNCTIONS = {
+    "MSH": createMSHBlock,
+    "OBX": createOBXBlock,
+    "ORC": createORCBlock,
+    "PID": createPIDBlock,
+    "RXA": createRXABlock,
+    "RXR": createRXRBlock,
+}
+
+# block function argument -> segments that require it
+#TODO might need to add PD1 here.
+SEGMENT_ARGS = {
+    "data": ("PID", "ORC", "OBX"),
+    "doh_json": ("MSH", "PID", "ORC", "OBX"),
+    "master_file_obj": ("PID", "OBX"),
+}
+NO_ARGS_SEGMENTS = ()
+
+
 def hl7_message_blocks_switch(segment_type: str, *args, **kargs) -> Callable:
     """Function to emulate switch statment for the different block functions.
 
@@ -358,17 +344,8 @@ def hl7_message_blocks_switch(segment_type: str, *args, **kargs) -> Callable:
     Returns:
         Callable
     """
-    segment_functions = {
-        "MSH": createMSHBlock,
-        "OBX": createOBXBlock,
-        "ORC": createORCBlock,
-        "PID": createPIDBlock,
-        "RXA": createRXABlock,
-        "RXR": createRXRBlock,
-    }
-
     try:
-        func = segment_functions[segment_type]
+        func = SEGMENT_FUNCTIONS[segment_type]
     except KeyError as e:
         raise KeyError("HL7 message block function not implemented.")
     else:
@@ -389,23 +366,31 @@ def section_requirements(
     Returns:
         dict
     """
-    #TODO might need to add PD1 here.
-    data_args = ["PID", "ORC", "OBX"]
-    master_file_obj_args = ["PID", "OBX"]
-    doh_json_args = ["MSH", "PID", "ORC", "OBX"]
+    arguments = {"data": data, "doh_json": doh_json, "master_file_obj": master_file_obj}
 
-    kargs = {}
+    return {
+        name: arguments[name]
+        for name in segment_arg_names(segment, SEGMENT_ARGS, NO_ARGS_SEGMENTS)
+    }
 
-    if segment in data_args:
-        kargs["data"] = data
 
-    if segment in doh_json_args:
-        kargs["doh_json"] = doh_json
+@lru_cache(maxsize=None)
+def compile_message_plan(segment_list: tuple) -> tuple:
+    """Function to compile a DOH segment list into a plan of bound renderers, cached by
+    segment list so it's built once per DOH configuration.
 
-    if segment in master_file_obj_args:
-        kargs["master_file_obj"] = master_file_obj
+    Args:
+        segment_list (tuple)
 
-    return kargs
+    Raises:
+        Exception: if a segment is not mapped, reporting the segment name.
+
+    Returns:
+        tuple: (segment, renderer) pairs.
+    """
+    return build_message_plan(
+        segment_list, SEGMENT_FUNCTIONS, SEGMENT_ARGS, NO_ARGS_SEGMENTS
+    )
 
 
 def create_message(data: Hl7Record, doh_json: dict, master_file_obj) -> str:
@@ -422,20 +407,13 @@ def create_message(data: Hl7Record, doh_json: dict, master_file_obj) -> str:
     Returns:
         str
     """
-    required_segments = doh_json["segment_list"]
+    plan = compile_message_plan(tuple(doh_json["segment_list"]))
     segment_list = []
 
     try:
-        for seg in required_segments:
-
-            kargs = section_requirements(
-                segment=seg,
-                data=data,
-                doh_json=doh_json,
-                master_file_obj=master_file_obj,
-            )
+        for seg, renderer in plan:
 
-            segment = hl7_message_blocks_switch(segment_type=seg, **kargs)
+            segment = renderer(data, doh_json, master_file_obj)
 
             segment_list.append(segment)
 
@@ -0,0 +1,76 @@
+import logging
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from typing import Callable
+
+# log keys of the Kafka record handled by each thread
+_RECORD_CONTEXT = threading.local()
+
+
+class RecordContextFilter(logging.Filter):
+    """Logging filter that stamps the keys of the Kafka record handled by the current
+    thread on every log line. Records processed concurrently keep their own context."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in record_keys().items():
+            setattr(record, key, value)
+
+        return True
+
+
+def add_record_context_filter(logger) -> None:
+    """Function to add the RecordContextFilter to a logger once.
+
+    Args:
+        logger (Logger)
+    """
+    if not any(isinstance(f, RecordContextFilter) for f in logger.filters):
+        logger.addFilter(RecordContextFilter())
+
+
+def record_keys() -> dict:
+    return getattr(_RECORD_CONTEXT, "keys", {})
+
+
+def append_record_keys(**keys) -> None:
+    """Function to add keys to the log context of the record handled by the current
+    thread. Use it instead of Logger.append_keys, which is shared by every thread."""
+    _RECORD_CONTEXT.keys = {**record_keys(), **keys}
+
+
+@contextmanager
+def record_context(**keys):
+    """Context manager to start a record log context on the current thread. The previous
+    context is restored on exit.
+
+    Args:
+        keys: initial log keys of the record.
+    """
+    previous = record_keys()
+    _RECORD_CONTEXT.keys = dict(keys)
+
+    try:
+        yield
+    finally:
+        _RECORD_CONTEXT.keys = previous
+
+
+def bind_record_context(func: Callable) -> Callable:
+    """Function to wrap func so it runs with the current thread record context, when it
+    is submitted to another thread.
+
+    Args:
+        func (Callable)
+
+    Returns:
+        Callable
+    """
+    keys = record_keys()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with record_context(**keys):
+            return func(*args, **kwargs)
+
+    return wrapper
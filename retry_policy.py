@@ -0,0 +1,219 @@
+import socket
+from functools import wraps
+from random import uniform
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Union
+
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+# errors raised before a response is received that may succeed on the next attempt
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    socket.timeout,
+    Timeout,
+    RequestsConnectionError,
+)
+RETRYABLE_STATUS_CODES = (408, 429)  # 5xx are retried as well
+# errors raised by our own handling of a response, a new attempt returns the same result
+PERMANENT_ERRORS = (ValueError, KeyError, TypeError, AttributeError, AssertionError)
+
+
+def error_status_code(error: Exception) -> Union[int, None]:
+    """Function to extract the HTTP status code carried by an API error, if any.
+
+    Args:
+        error (Exception)
+
+    Returns:
+        Union[int, None]
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", getattr(response, "status_code", None))
+
+    return int(status_code) if status_code is not None else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Function to classify an error as retryable: throttling, timeouts, server errors
+    and connection errors. Any other error with a status is permanent.
+
+    Args:
+        error (Exception)
+
+    Returns:
+        bool
+    """
+    status_code = error_status_code(error)
+
+    if status_code is not None:
+        return status_code >= 500 or status_code in RETRYABLE_STATUS_CODES
+
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def is_unrecognised(error: Exception) -> bool:
+    """Function to flag errors that can not be classified, such as a plain Exception
+    raised by the API client for an HTTP error without exposing its status.
+
+    Args:
+        error (Exception)
+
+    Returns:
+        bool
+    """
+    return (
+        error_status_code(error) is None
+        and not isinstance(error, TRANSIENT_ERRORS)
+        and not isinstance(error, PERMANENT_ERRORS)
+    )
+
+
+def allowed_attempts(error: Exception, max_attempts: int, unknown_error_attempts: int) -> int:
+    """Function to get the number of attempts allowed for an error: every attempt for
+    retryable errors, a bounded number for unrecognised errors and one for permanent ones.
+
+    Args:
+        error (Exception)
+        max_attempts (int)
+        unknown_error_attempts (int)
+
+    Returns:
+        int
+    """
+    if is_retryable(error):
+        return max_attempts
+
+    if is_unrecognised(error):
+        return min(unknown_error_attempts, max_attempts)
+
+    return 1
+
+
+def backoff_with_jitter(attempt: int, base_sleep: float, max_sleep: float) -> float:
+    """Function to compute the exponential backoff with full jitter for an attempt.
+
+    Args:
+        attempt (int): 1 for the first retry.
+        base_sleep (float)
+        max_sleep (float)
+
+    Returns:
+        float
+    """
+    return uniform(0, min(max_sleep, base_sleep * 2 ** (attempt - 1)))
+
+
+class RetryBudget:
+    """Class to cap the retries of one lambda invocation, by count and by deadline."""
+
+    def __init__(self, max_retries: int, deadline_reserve: float):
+        """Constructor takes the retries allowed per invocation and the seconds kept free
+        before the lambda deadline.
+
+        Args:
+            max_retries (int)
+            deadline_reserve (float)
+        """
+        self.max_retries = max_retries
+        self.deadline_reserve = deadline_reserve
+
+        self._lock = Lock()
+        self.retries_left = max_retries
+        self.deadline = None
+        self.retries_denied = 0
+
+    def reset(self, remaining_time_ms: int = None) -> None:
+        """Method to start a new invocation budget.
+
+        Args:
+            remaining_time_ms (int, optional). Lambda remaining time. Defaults to None.
+        """
+        with self._lock:
+            self.retries_left = self.max_retries
+            self.retries_denied = 0
+            self.deadline = (
+                monotonic() + remaining_time_ms / 1000
+                if remaining_time_ms is not None
+                else None
+            )
+
+    def allows(self, sleep_time: float) -> bool:
+        """Method to consume one retry if the budget and the deadline allow it.
+
+        Args:
+            sleep_time (float)
+
+        Returns:
+            bool
+        """
+        with self._lock:
+            out_of_time = (
+                self.deadline is not None
+                and monotonic() + sleep_time + self.deadline_reserve > self.deadline
+            )
+
+            if self.retries_left <= 0 or out_of_time:
+                self.retries_denied += 1
+                return False
+
+            self.retries_left -= 1
+
+            return True
+
+
+def retry_policy_decorator(
+    max_attempts: int,
+    logger,
+    base_sleep: float,
+    max_sleep: float,
+    budget: RetryBudget,
+    unknown_error_attempts: int = 1,
+) -> Callable:
+    """Decorator to retry retryable errors with exponential backoff and jitter.
+    Unrecognised errors are retried up to unknown_error_attempts. Permanent errors,
+    an exhausted budget or a close deadline re-raise immediately.
+
+    Args:
+        max_attempts (int)
+        logger (Logger)
+        base_sleep (float)
+        max_sleep (float)
+        budget (RetryBudget)
+        unknown_error_attempts (int)
+
+    Returns:
+        Callable
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    attempts = allowed_attempts(e, max_attempts, unknown_error_attempts)
+
+                    if attempts == 1:
+                        logger.warning(f"{func.__name__} permanent error, not retrying. Error: {e}")
+                        raise
+
+                    if attempt >= attempts:
+                        raise
+
+                    sleep_time = backoff_with_jitter(attempt, base_sleep, max_sleep)
+
+                    if not budget.allows(sleep_time):
+                        logger.warning(f"{func.__name__} retry budget exhausted. Error: {e}")
+                        raise
+
+                    logger.warning(
+                        f"{func.__name__} attempt {attempt} failed, retrying in {sleep_time:.2f}s. Error: {e}"
+                    )
+                    sleep(sleep_time)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,92 @@
+from threading import Lock
+from time import monotonic
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class TtlLruCache:
+    """Thread safe least recently used cache where every entry has its own time to live.
+    Hit, miss, eviction and expiration counters are kept to size the cache."""
+
+    def __init__(self, max_entries: int):
+        """Constructor takes the maximum number of entries kept before the least
+        recently used entry is evicted.
+
+        Args:
+            max_entries (int)
+        """
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Method to return a cached value. Expired entries are dropped and count as misses.
+
+        Args:
+            key (Hashable)
+            default (Any, optional). Defaults to None.
+
+        Returns:
+            Any
+        """
+        with self._lock:
+            value, expires_at = self._entries.get(key, (_MISSING, None))
+
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            if expires_at <= monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        """Method to cache a value for ttl seconds.
+
+        Args:
+            key (Hashable)
+            value (Any)
+            ttl (float)
+        """
+        with self._lock:
+            self._entries[key] = (value, monotonic() + ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Method to return the cache counters.
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }